@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+    *******************************************************************************************
+    SNKRsBench: Offline end-to-end benchmark of SNKRsBot against a local mock storefront
+    Author: Ali Toori, Python Bot Developer
+    Website: https://botflocks.com/
+    LinkedIn: https://www.linkedin.com/in/alitoori/
+    *******************************************************************************************
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlparse
+
+from SNKRsBot import LOGGER, Account, SNKRsBot, SessionStore, Target, Timings
+
+PRODUCT_TITLE = 'Bench Runner Light Photo Blue'
+PRODUCT_SLUG = 'bench-runner-light-photo-blue'
+SIZES = ('42', '43', '44', '44.5', '45')
+
+# Imagery, fonts and video the real pages load, so that page weight and blocking can be measured
+ASSETS = {'/static/hero.jpg': 250000, '/static/product.webp': 150000, '/static/brand.woff2': 60000, '/static/teaser.mp4': 800000}
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Mock storefront</title>
+<style>@font-face { font-family: Brand; src: url('/static/brand.woff2'); } body { font-family: Brand; }</style>
+<script>
+function show(id) { document.getElementById(id).hidden = false; }
+</script></head>
+<body><img src="/static/hero.jpg" alt=""><video src="/static/teaser.mp4" preload="auto" muted></video>
+{body}</body></html>
+"""
+
+HOME = """
+<nav>{account}</nav>
+<div id="login" hidden>
+    <input type="email"><input type="password">
+    <input type="button" value="Sign In" onclick="signIn()">
+</div>
+<section id="feed">{cards}</section>
+<script>
+function signIn() {
+    const email = document.querySelector('input[type="email"]').value;
+    document.cookie = 'session=' + encodeURIComponent(email) + '; max-age=86400; path=/';
+    document.getElementById('login').hidden = true;
+    document.querySelector('nav').innerHTML = '<span data-qa="user-name">' + email + '</span>';
+}
+</script>
+"""
+
+CART = """
+<h4>Bag</h4>
+<div id="item"><span>{title}</span>
+    <button name="remove-item-button" onclick="document.getElementById('item').remove(); show('empty')">Remove</button>
+</div>
+<p data-automation="no-items" id="empty" hidden>There are no items in your bag.</p>
+"""
+
+PRODUCT = """
+<h2>{title}</h2>
+<img src="/static/product.webp" alt="">
+<ul>{sizes}</ul>
+<button class="ncss-btn-primary-dark btn-lg capitalize" onclick="show('to-checkout')">Add to Bag</button>
+<div id="to-checkout" hidden>
+    <button class="ncss-btn-primary-dark" onclick="location.href='/checkout'">Checkout</button>
+</div>
+<script>
+document.querySelectorAll('li[data-qa="size-available"]').forEach(size => size.onclick = () => size.className = 'selected');
+</script>
+"""
+
+CHECKOUT = """
+<h1>Checkout</h1>
+<section>
+    <a aria-label="Edit Shipping" href="#" onclick="show('address-choice'); return false">Edit</a>
+    <div id="address-choice" hidden><button class="ncss-btn-clear u-underline" onclick="show('address-form')">Add Address</button></div>
+    <form id="address-form" hidden onsubmit="event.preventDefault(); show('to-payment')">
+        <input id="firstName"><input id="lastName"><input id="address1"><input id="email"><input id="phoneNumber">
+        <button type="submit">Save</button>
+    </form>
+    <div id="to-payment" hidden><button type="button" onclick="show('payment')">Continue to Payment</button></div>
+</section>
+<section id="payment" hidden>
+    <a aria-label="Edit Payment" href="#" onclick="show('card-choice'); return false">Edit</a>
+    <div id="card-choice" hidden><input type="radio" id="newCard" onclick="show('card-form')"><label for="newCard">New card</label></div>
+    <div id="card-form" hidden>
+        <input id="creditCardNumber"><input id="expirationDate">
+        <input type="checkbox" id="saveCreditCardData"><label for="saveCreditCardData">Save card</label>
+        <button class="test-payment-use-card" onclick="useCard()">Use card</button>
+    </div>
+    <button data-attr="continueToOrderReviewBtn" onclick="review()">Continue to Order Review</button>
+</section>
+<section id="review"><input id="cvNumber"></section>
+<p data-qa="order-confirmation" hidden>Thank you for your order</p>
+<script>
+// A new card closes the payment form and leaves the review step, its CVV has to be entered again
+function useCard() {
+    document.getElementById('card-form').hidden = true;
+    document.getElementById('review').hidden = true;
+}
+// Moves to the review step with an empty CVV. The order is only placed when the button is clicked on the
+// review step after a CVV was entered there, which is what place_order does
+function review() {
+    const review = document.getElementById('review'), cvv = document.getElementById('cvNumber');
+    if (review.hidden || !cvv.value) {
+        review.hidden = false;
+        cvv.value = '';
+        return;
+    }
+    fetch('/order', {method: 'POST'}).then(() => show('order-confirmation'));
+}
+</script>
+"""
+
+
+# Local stand-in for the Nike pages with the selectors the bot uses, a configurable
+# latency per request and a drop time after which the product is listed and in stock
+class MockStorefront:
+    def __init__(self, latency=0.05, port=0):
+        self.latency = latency
+        self.drop_at = float('inf')
+        # Email -> time.time() of the first order
+        self.orders = {}
+        self.lock = threading.Lock()
+        storefront = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                storefront.handle(self)
+
+            def do_POST(self):
+                storefront.handle(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='MockStorefront', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def schedule_drop(self, delay):
+        self.drop_at = time.time() + delay
+        with self.lock:
+            self.orders.clear()
+        return self.drop_at
+
+    def dropped(self):
+        return time.time() >= self.drop_at
+
+    def handle(self, request):
+        time.sleep(self.latency)
+        path = urlparse(request.path).path.rstrip('/') or '/'
+        cookie = SimpleCookie(request.headers.get('Cookie', ''))
+        session = cookie['session'].value if 'session' in cookie else None
+        if path == '/order' and request.command == 'POST':
+            with self.lock:
+                self.orders.setdefault(session, time.time())
+            return self.respond(request, 204, '')
+        if path == '/':
+            account = '<div id="AccountMenu">Account</div>' if session else \
+                '<button data-path="sign in" onclick="show(\'login\')">Sign In</button>'
+            cards = '<a data-qa="product-card-link" aria-label="Filler Runner" href="/launch/t/filler-runner">Filler</a>'
+            if self.dropped():
+                cards += f'<a data-qa="product-card-link" aria-label="{PRODUCT_TITLE}" href="/launch/t/{PRODUCT_SLUG}">Drop</a>'
+            body = HOME.replace('{account}', account).replace('{cards}', cards)
+        elif path == '/cart':
+            body = CART.replace('{title}', PRODUCT_TITLE)
+        elif path.startswith('/launch/t/'):
+            sizes = ''.join(f'<li data-qa="size-available">{size}</li>' for size in SIZES) if self.dropped() else ''
+            body = PRODUCT.replace('{title}', PRODUCT_TITLE).replace('{sizes}', sizes)
+        elif path == '/checkout':
+            body = CHECKOUT
+        elif path in ASSETS:
+            return self.respond(request, 200, bytes(ASSETS[path]), content_type='application/octet-stream')
+        else:
+            return self.respond(request, 404, 'Not found')
+        self.respond(request, 200, PAGE.replace('{body}', body))
+
+    @staticmethod
+    def respond(request, status, body, content_type='text/html; charset=utf-8'):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+
+# Runs SNKRsBot against the mock storefront with the given number of concurrent accounts
+def run_benchmark(storefront, concurrency, drop_delay, scheduled=False, headless=True, blocking='checkout', processes=1):
+    bot = SNKRsBot()
+    bot.NIKE_HOME_URL = bot.SNKRS_STOCK_URL = storefront.url + '/'
+    bot.SNKRS_HOME_URL = storefront.url + '/launch'
+    bot.NIKE_CART_URL = storefront.url + '/cart'
+    bot.NIKE_CHECKOUT_URL = storefront.url + '/checkout'
+    # The accounts are split evenly across the processes
+    bot.PROCESSES = processes
+    bot.MAX_WORKERS = -(-concurrency // processes)
+    bot.HEADLESS = headless
+    bot.BLOCKING_PROFILE = blocking
+    bot.MEASURE_PAGES = True
+    bot.clock_offset = 0.0
+    bot.timings = Timings()
+    session_dir = tempfile.mkdtemp(prefix='SNKRsBench_')
+    bot.session_store = SessionStore(Path(session_dir) / 'Sessions.db')
+    drop_at = storefront.schedule_drop(drop_delay)
+    accounts = [Account(AccountNo=number, Email=f'bench{number}@example.com', Password='bench', Proxy='No',
+                        ChangeShipping=True, AddNewCard=True, FirstName='Bench', LastName='Runner',
+                        Address='1 Mock Street', Phone='0000000000', CardNumber='4111111111111111',
+                        CardExpiry='12/30', CVV='123',
+                        Targets=[Target(ProductTitle=PRODUCT_TITLE, ProductURL=f'{storefront.url}/launch/t/{PRODUCT_SLUG}',
+                                        ShoesSizes=('41', '44', '45'), ReleaseTime=drop_at if scheduled else None)])
+                for number in range(1, concurrency + 1)]
+    started = time.time()
+    if processes > 1:
+        bot.run_sharded(accounts)
+    else:
+        bot.run_tasks(accounts)
+    finished = time.time()
+    with storefront.lock:
+        order_times = sorted(storefront.orders.values())
+    latencies = [order_time - drop_at for order_time in order_times]
+    result = {
+        'accounts': concurrency,
+        'processes': processes,
+        'blocking': blocking,
+        'orders': len(order_times),
+        'confirmed': sum(result == 'Confirmed' for results in bot.order_results.values() for result in results.values()),
+        'wall_s': round(finished - started, 3),
+        # Orders per second from the drop to the last order
+        'throughput_per_s': round(len(order_times) / (order_times[-1] - drop_at), 3) if order_times else 0.0,
+    }
+    for percent in Timings.PERCENTILES:
+        result[f'e2e_p{percent}_ms'] = round(Timings.percentile(latencies, percent) * 1000, 1) if latencies else None
+    result['stages'] = {row['span']: {key: row[key] for key in ('count', 'p50_ms', 'p90_ms', 'max_ms')}
+                        for row in bot.timings.summary()
+                        if row['account'] == '*' and row['span'].count('/') == 1}
+    result['pages'] = bot.timings.page_summary()
+    # Peak browser memory and CPU, per shard when the accounts ran in several processes
+    result['resources'] = bot.shard_resources or bot.governor.summary()
+    return result
+
+
+# Bytes and page-load time saved per stage by a blocking profile compared to a run without blocking
+def blocking_savings(baseline, blocked):
+    savings = {}
+    for stage, page in blocked['pages'].items():
+        base = baseline['pages'].get(stage)
+        if base is None:
+            continue
+        savings[stage] = {'bytes_saved': base['avg_bytes'] - page['avg_bytes']}
+        if base['load_p50_ms'] is not None and page['load_p50_ms'] is not None:
+            savings[stage]['load_p50_saved_ms'] = round(base['load_p50_ms'] - page['load_p50_ms'], 1)
+    return savings
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark SNKRsBot against a local mock storefront')
+    arg_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    arg_parser.add_argument('--processes', type=int, nargs='+', default=[1], help='worker processes the accounts are split across')
+    arg_parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every request')
+    arg_parser.add_argument('--drop-delay', type=float, default=30, help='seconds from start to the drop')
+    arg_parser.add_argument('--scheduled', action='store_true', help='use a ReleaseTime instead of the drop monitor')
+    arg_parser.add_argument('--headful', action='store_true', help='show the browsers')
+    arg_parser.add_argument('--blocking', default='checkout', choices=sorted(SNKRsBot.BLOCKING_PROFILES))
+    arg_parser.add_argument('--compare-blocking', action='store_true', help='also run without blocking and report the savings')
+    arg_parser.add_argument('--port', type=int, default=0)
+    arg_parser.add_argument('--serve', action='store_true', help='only run the mock storefront')
+    arg_parser.add_argument('--output', type=Path, help='write the results as JSON')
+    args = arg_parser.parse_args()
+    storefront = MockStorefront(latency=args.latency, port=args.port).start()
+    LOGGER.info(f'Mock storefront running: {storefront.url}')
+    try:
+        if args.serve:
+            storefront.schedule_drop(args.drop_delay)
+            while True:
+                time.sleep(1)
+        results = []
+        for concurrency in args.concurrency:
+            for processes in args.processes:
+                LOGGER.info(f'Benchmarking {concurrency} concurrent accounts in {processes} processes')
+                result = run_benchmark(storefront, concurrency, args.drop_delay, scheduled=args.scheduled,
+                                       headless=not args.headful, blocking=args.blocking, processes=processes)
+                if args.compare_blocking and args.blocking != 'off':
+                    baseline = run_benchmark(storefront, concurrency, args.drop_delay, scheduled=args.scheduled,
+                                             headless=not args.headful, blocking='off', processes=processes)
+                    result['blocking_savings'] = blocking_savings(baseline, result)
+                    results.append(baseline)
+                results.append(result)
+                LOGGER.info(f'Result: {json.dumps(result)}')
+        print(json.dumps(results, indent=2))
+        if args.output:
+            args.output.write_text(json.dumps(results, indent=2))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        storefront.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,37 +7,73 @@
     LinkedIn: https://www.linkedin.com/in/alitoori/
     *******************************************************************************************
 """
+import time
+# Measured from here to the launch of the first task, see SNKRsBot.main
+STARTUP_TIME = time.perf_counter()
+import atexit
 import concurrent.futures
+import csv
+import json
 import logging.config
+import logging.handlers
 import os
 import pickle
+import queue
+import signal
+import sqlite3
 import sys
-import time
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from time import sleep
-import ntplib
-import pandas as pd
-import pyfiglet
-from datetime import datetime, timedelta
-from dateutil import parser as date_parser
-from selenium import webdriver
-import undetected_chromedriver as uc
+from datetime import datetime
 from multiprocessing import freeze_support
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
+# Heavy dependencies (selenium, undetected_chromedriver, ntplib, dateutil, pyfiglet)
+# are imported where they are used so that a restart is not slowed down by them
+
+# Per-thread log context, the account a worker thread is currently running
+LOG_CONTEXT = threading.local()
+
+
+# Adds the account of the emitting thread to every record, unless it was passed in extra={'account': ...}
+class AccountFilter(logging.Filter):
+    def filter(self, record):
+        if not hasattr(record, 'account'):
+            record.account = getattr(LOG_CONTEXT, 'account', '')
+        return True
+
+
+# One JSON object per line, for the rotating log file
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'account': getattr(record, 'account', ''),
+            'process': record.processName,
+            'thread': record.threadName,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# Worker threads only put records on this queue, a background listener writes them out
+LOG_QUEUE = queue.SimpleQueue()
 
 logging.config.dictConfig({
     "version": 1,
     "disable_existing_loggers": False,
+    'filters': {
+        'account': {'()': AccountFilter},
+    },
     'formatters': {
         'colored': {
             '()': 'colorlog.ColoredFormatter',  # colored output
             # --> %(log_color)s is very important, that's what colors the line
-            'format': '[%(asctime)s,%(lineno)s] %(log_color)s[%(message)s]',
+            'format': '[%(asctime)s,%(lineno)s] %(log_color)s[%(account)s] [%(message)s]',
             'log_colors': {
                 'DEBUG': 'green',
                 'INFO': 'cyan',
@@ -46,11 +82,16 @@ logging.config.dictConfig({
                 'CRITICAL': 'bold_red',
             },
         },
-        'simple': {
-                'format': '[%(asctime)s,%(lineno)s] [%(message)s]',
-            },
+        'json': {
+            '()': JsonFormatter,
+        },
     },
     "handlers": {
+        "queue": {
+            "()": logging.handlers.QueueHandler,
+            "queue": LOG_QUEUE,
+            "filters": ["account"],
+        },
         "console": {
             "class": "colorlog.StreamHandler",
             "level": "INFO",
@@ -60,21 +101,947 @@ logging.config.dictConfig({
         "file": {
             "class": "logging.handlers.RotatingFileHandler",
             "level": "INFO",
-            "formatter": "simple",
-            "filename": "SNKRsBot_logs.log"
+            "formatter": "json",
+            "filename": "SNKRsBot_logs.log",
+            "maxBytes": 5 * 1024 * 1024,
+            "backupCount": 5,
+            "encoding": "utf-8",
+            # Opened by the first record, shard processes never write to it themselves
+            "delay": True,
         },
     },
+    "loggers": {
+        # Only used by the listener below, nothing logs to it directly
+        "SNKRsBot.writer": {"handlers": ["console", "file"], "propagate": False},
+    },
     "root": {"level": "INFO",
-             "handlers": ["console", "file"]
+             "handlers": ["queue"]
              }
 })
 
+LOG_LISTENER = logging.handlers.QueueListener(LOG_QUEUE, *logging.getLogger("SNKRsBot.writer").handlers, respect_handler_level=True)
+LOG_LISTENER.start()
+# Flush the queue on exit
+atexit.register(LOG_LISTENER.stop)
+
 LOGGER = logging.getLogger()
 
+# Seconds a single execute_async_script call may take, set on every driver in get_driver
+SCRIPT_TIMEOUT = 60
+
+# Errors of an async script whose document was unloaded by a navigation before it resolved
+NAVIGATION_ERRORS = ('document unloaded', 'Execution context was destroyed', 'Cannot find context with specified id')
+
+# Resolves with the first visible (and enabled) element matching the selector, or null on timeout
+WAIT_SCRIPT = """
+const [by, selector, clickable, timeout, done] = arguments;
+function find() {
+    const element = by === 'xpath'
+        ? document.evaluate(selector, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(selector);
+    if (!element || !element.getClientRects().length) return null;
+    const style = window.getComputedStyle(element);
+    if (style.visibility === 'hidden' || style.display === 'none') return null;
+    if (clickable && element.disabled) return null;
+    return element;
+}
+let element = find();
+if (element) return done(element);
+const observer = new MutationObserver(() => {
+    element = find();
+    if (element) finish(element);
+});
+const timer = setTimeout(() => finish(null), timeout);
+function finish(result) {
+    observer.disconnect();
+    clearTimeout(timer);
+    done(result);
+}
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+"""
+
+# Reads the size grid and the product cards of the current page in one pass
+SCAN_SCRIPT = """
+const text = element => (element.innerText || element.textContent || '').trim();
+return {
+    sizes: Array.from(document.querySelectorAll('li[data-qa="size-available"]'), size => [text(size), size]),
+    cards: Array.from(document.querySelectorAll('a[data-qa="product-card-link"]'),
+                      card => [card.getAttribute('aria-label') || '', card.href || '']),
+};
+"""
+
+# Bytes transferred and load time of the current document and its resources
+PAGE_STATS_SCRIPT = """
+const [navigation] = performance.getEntriesByType('navigation');
+const resources = performance.getEntriesByType('resource');
+return {
+    url: location.href,
+    requests: resources.length + 1,
+    bytes: resources.reduce((total, entry) => total + entry.transferSize, navigation ? navigation.transferSize : 0),
+    load_ms: navigation && navigation.loadEventEnd ? navigation.loadEventEnd - navigation.startTime : null,
+};
+"""
+
+# Fills [selector, value] fields and clicks the given selectors afterwards, returns the first missing selector
+FILL_SCRIPT = """
+const [fields, clicks] = arguments;
+for (const [selector, value] of fields) {
+    const element = document.querySelector(selector);
+    if (!element) return selector;
+    element.focus();
+    // Use the native setter so that frameworks tracking the value see the change
+    const setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(element), 'value').set;
+    setter.call(element, value);
+    for (const type of ['input', 'change', 'blur']) {
+        element.dispatchEvent(new Event(type, {bubbles: true}));
+    }
+}
+for (const selector of clicks) {
+    const element = document.querySelector(selector);
+    if (!element) return selector;
+    element.click();
+}
+return null;
+"""
+
+
+# Collects nested timing spans per account and aggregates them into percentiles for the run report
+class Timings:
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        # (account, span path, seconds)
+        self.spans = []
+        # (account, stage, bytes transferred, page-load ms)
+        self.pages = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    # Account the spans of the current thread are recorded for
+    def set_account(self, account):
+        self.local.account = account
+
+    # Times the block, nested spans are recorded with their parents' names as path: buy_drop/login_nike/cmd:get
+    @contextmanager
+    def span(self, name, account=None):
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        path = '/'.join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                self.spans.append((account or getattr(self.local, 'account', ''), path, duration))
+
+    @staticmethod
+    def percentile(values, percent):
+        # Nearest-rank percentile of sorted values
+        return values[max(0, -(-len(values) * percent // 100) - 1)]
+
+    # Adds the spans and pages recorded by a shard process
+    def merge(self, spans, pages):
+        with self.lock:
+            self.spans.extend(spans)
+            self.pages.extend(pages)
+
+    # Bytes transferred and load time of the page a stage ended on
+    def record_page(self, stage, transfer_bytes, load_ms, account=None):
+        with self.lock:
+            self.pages.append((account or getattr(self.local, 'account', ''), stage, transfer_bytes, load_ms))
+
+    # Average bytes and load time percentiles per stage across the run
+    def page_summary(self):
+        groups = {}
+        with self.lock:
+            for account, stage, transfer_bytes, load_ms in self.pages:
+                groups.setdefault(stage, []).append((transfer_bytes, load_ms))
+        summary = {}
+        for stage, pages in sorted(groups.items()):
+            load_times = sorted(load_ms for transfer_bytes, load_ms in pages if load_ms is not None)
+            summary[stage] = {
+                'count': len(pages),
+                'avg_bytes': round(sum(transfer_bytes for transfer_bytes, load_ms in pages) / len(pages)),
+                'load_p50_ms': round(self.percentile(load_times, 50), 1) if load_times else None,
+                'load_p90_ms': round(self.percentile(load_times, 90), 1) if load_times else None,
+            }
+        return summary
+
+    # Aggregates spans per account and across the run ('*')
+    def summary(self):
+        groups = {}
+        with self.lock:
+            for account, path, duration in self.spans:
+                groups.setdefault((account, path), []).append(duration)
+                groups.setdefault(('*', path), []).append(duration)
+        rows = []
+        for (account, path), durations in sorted(groups.items()):
+            durations.sort()
+            row = {'account': account, 'span': path, 'count': len(durations), 'total_s': round(sum(durations), 4)}
+            for percent in self.PERCENTILES:
+                row[f'p{percent}_ms'] = round(self.percentile(durations, percent) * 1000, 2)
+            row['max_ms'] = round(durations[-1] * 1000, 2)
+            rows.append(row)
+        return rows
+
+    # Writes the summary as JSON and CSV, returns the paths
+    def export(self, directory, extra=None):
+        rows = self.summary()
+        directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        json_path = directory / f'Report_{stamp}.json'
+        csv_path = directory / f'Report_{stamp}.csv'
+        with open(json_path, 'w') as report_file:
+            json.dump(dict(extra or {}, spans=rows, pages=self.page_summary()), report_file, indent=2)
+        with open(csv_path, 'w', newline='') as report_file:
+            writer = csv.DictWriter(report_file, fieldnames=list(rows[0]) if rows else ['account', 'span'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return json_path, csv_path
+
+
+# A product an account tries to buy: one per row of Accounts.csv
+class Target:
+    FIELDS = ('ProductTitle', 'ProductURL', 'ShoesSizes', 'ReleaseTime', 'Priority')
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __repr__(self):
+        return f'Target({self.ProductURL})'
+
+    # Order in which an account serves its targets: scheduled releases by time, then by priority,
+    # targets without a ReleaseTime last as they wait on the drop monitor
+    def sort_key(self):
+        return self.ReleaseTime is None, self.ReleaseTime or 0, self.Priority or 0
+
+    # Builds a target from a cleaned Accounts.csv row, raises ValueError for an invalid row
+    @classmethod
+    def from_row(cls, row, priority=0):
+        fields = {'ProductTitle': row.get('ProductTitle', ''), 'ProductURL': row['ProductURL']}
+        # Sizes in priority order
+        fields['ShoesSizes'] = tuple(size.strip() for size in row['ShoesSizes'].split(':') if size.strip())
+        try:
+            fields['ReleaseTime'] = SNKRsBot.parse_time(row.get('ReleaseTime'))
+        except (ValueError, OverflowError):
+            raise ValueError(f'invalid ReleaseTime: {row["ReleaseTime"]}')
+        if row.get('Priority') and not row['Priority'].lstrip('-').isdigit():
+            raise ValueError(f'Priority is not a number: {row["Priority"]}')
+        fields['Priority'] = int(row['Priority']) if row.get('Priority') else priority
+        return cls(**fields)
+
+
+# An account from Accounts.csv, converted and validated at load time. Rows with the same Email
+# are one account with several targets, served one after another by the same browser
+class Account:
+    FIELDS = ('AccountNo', 'Email', 'Password', 'Proxy', 'ShoesSizes', 'ShoesColor', 'ChangeShipping', 'AddNewCard',
+              'FirstName', 'LastName', 'Address', 'Phone', 'CardNumber', 'CardExpiry', 'CVV', 'LoginTime')
+    # CVV is typed in by place_order for every order
+    REQUIRED = ('AccountNo', 'Email', 'Password', 'ProductURL', 'ShoesSizes', 'CVV')
+    # Required when ChangeShipping or AddNewCard is Yes, empty cells would be typed into the checkout as 'None'
+    SHIPPING_FIELDS = ('FirstName', 'LastName', 'Address', 'Phone')
+    CARD_FIELDS = ('CardNumber', 'CardExpiry')
+    __slots__ = FIELDS + ('Targets', 'Current')
+
+    def __init__(self, Targets=(), **fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.get(field))
+        # Targets not served yet, in the order of Target.sort_key
+        self.Targets = sorted(Targets, key=Target.sort_key)
+        # Target being bought right now or the last one bought, set by SNKRsBot.next_target
+        self.Current = None
+
+    # Accounts are also read like the pandas rows they replaced: account["Email"]
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def __repr__(self):
+        return f'Account({self.AccountNo}, {self.Email}, {len(self.Targets)} targets)'
+
+    def add_target(self, target):
+        self.Targets.append(target)
+        self.Targets.sort(key=Target.sort_key)
+
+    # Cleans a csv.DictReader row, raises ValueError for an invalid row
+    @classmethod
+    def clean_row(cls, row):
+        row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        required = list(cls.REQUIRED)
+        if row.get('ChangeShipping', '').lower() == 'yes':
+            required += cls.SHIPPING_FIELDS
+        if row.get('AddNewCard', '').lower() == 'yes':
+            required += cls.CARD_FIELDS
+        missing = [field for field in required if not row.get(field)]
+        if missing:
+            raise ValueError(f'missing {", ".join(missing)}')
+        if not row['AccountNo'].isdigit():
+            raise ValueError(f'AccountNo is not a number: {row["AccountNo"]}')
+        if '@' not in row['Email']:
+            raise ValueError(f'invalid Email: {row["Email"]}')
+        return row
+
+    # Builds an account with the row's target from a cleaned row, raises ValueError for an invalid row
+    @classmethod
+    def from_row(cls, row):
+        fields = {field: row.get(field) or None for field in cls.FIELDS}
+        fields['AccountNo'] = int(row['AccountNo'])
+        fields['Proxy'] = row.get('Proxy') or 'No'
+        # Sizes of the account's first row, used for products added through URL.txt
+        fields['ShoesSizes'] = tuple(size.strip() for size in row['ShoesSizes'].split(':') if size.strip())
+        fields['ChangeShipping'] = row.get('ChangeShipping', '').lower() == 'yes'
+        fields['AddNewCard'] = row.get('AddNewCard', '').lower() == 'yes'
+        try:
+            fields['LoginTime'] = SNKRsBot.parse_time(row.get('LoginTime'))
+        except (ValueError, OverflowError):
+            raise ValueError(f'invalid LoginTime: {row["LoginTime"]}')
+        return cls(Targets=[Target.from_row(row)], **fields)
+
+
+# Keeps the cookies of all accounts in one SQLite file, indexed by email, with their expiry
+# so that dead sessions are recognized without loading a page. Also keeps the last completed
+# stage per account and product, see SNKRsBot.STAGES
+class SessionStore:
+    # Prefixes of analytics, marketing and bot-protection cookies. They expire after minutes or hours
+    # and say nothing about the login, so they never decide when a session expires
+    IGNORED_COOKIES = ('_ga', '_gid', '_gat', '_gcl_', '_fbp', '_uet', '_scid', '_ttp', '_pin_', '_hj', 'AMCV_', 'AMCVS_',
+                       's_', 'RT', 'optimizely', '_abck', 'bm_', 'ak_bmsc')
+
+    def __init__(self, path, legacy_dir=None, cookie_names=()):
+        # Cookies which decide when a session expires, all persistent cookies but IGNORED_COOKIES if empty
+        self.cookie_names = set(cookie_names)
+        self.path = str(path)
+        self.legacy_dir = legacy_dir
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        # Shard processes read and write the same file concurrently
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sessions (email TEXT PRIMARY KEY, cookies TEXT NOT NULL, '
+                        'expires REAL, verified REAL, dead INTEGER NOT NULL DEFAULT 0)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS checkpoints (email TEXT NOT NULL, product_url TEXT NOT NULL, '
+                        'stage TEXT NOT NULL, updated REAL NOT NULL, PRIMARY KEY (email, product_url))')
+        self.db.commit()
+
+    # Earliest expiry of the session cookies, None when they only live as long as the browser
+    def expiry(self, cookies):
+        expiries = [cookie['expiry'] for cookie in cookies if 'expiry' in cookie and self.is_session_cookie(cookie['name'])]
+        return min(expiries) if expiries else None
+
+    def is_session_cookie(self, name):
+        if self.cookie_names:
+            return name in self.cookie_names
+        return not name.startswith(self.IGNORED_COOKIES)
+
+    def save(self, email, cookies, verified=None):
+        with self.lock:
+            self.db.execute('REPLACE INTO sessions VALUES (?, ?, ?, ?, 0)',
+                            (email, json.dumps(cookies), self.expiry(cookies), verified))
+            self.db.commit()
+
+    # Returns (cookies, expires, verified, dead) of the account, importing an old Cookies_<email>.pkl once
+    def get(self, email):
+        with self.lock:
+            row = self.db.execute('SELECT cookies, expires, verified, dead FROM sessions WHERE email = ?', (email,)).fetchone()
+        if row is not None:
+            return json.loads(row[0]), row[1], row[2], bool(row[3])
+        legacy_path = self.legacy_dir / f'Cookies_{email}.pkl' if self.legacy_dir else None
+        if legacy_path is not None and legacy_path.is_file():
+            with open(legacy_path, 'rb') as cookies_file:
+                cookies = pickle.load(cookies_file)
+            self.save(email, cookies)
+            return cookies, self.expiry(cookies), None, False
+        return None
+
+    def mark_verified(self, email):
+        with self.lock:
+            self.db.execute('UPDATE sessions SET verified = ?, dead = 0 WHERE email = ?', (time.time(), email))
+            self.db.commit()
+
+    def mark_dead(self, email):
+        with self.lock:
+            self.db.execute('UPDATE sessions SET dead = 1 WHERE email = ?', (email,))
+            self.db.commit()
+
+    # Whether the account has a session which is not known to be dead and doesn't expire before the given time
+    def is_alive(self, email, at=None):
+        session = self.get(email)
+        if session is None or session[3]:
+            return False
+        return session[1] is None or session[1] > (at or time.time())
+
+    def checkpoint(self, email, product_url, stage):
+        with self.lock:
+            self.db.execute('REPLACE INTO checkpoints VALUES (?, ?, ?, ?)', (email, product_url, stage, time.time()))
+            self.db.commit()
+
+    # Last completed stage of buying the product, None if there is none saved in the last max_age seconds
+    def last_stage(self, email, product_url, max_age):
+        with self.lock:
+            row = self.db.execute('SELECT stage FROM checkpoints WHERE email = ? AND product_url = ? AND updated > ?',
+                                  (email, product_url, time.time() - max_age)).fetchone()
+        return row[0] if row is not None else None
+
+    def clear_checkpoint(self, email, product_url):
+        with self.lock:
+            self.db.execute('DELETE FROM checkpoints WHERE email = ? AND product_url = ?', (email, product_url))
+            self.db.commit()
+
+
+# Admits a new browser only while the browsers of the bot stay within the memory budget, launches beyond it
+# wait in line until one is finished. RSS and CPU are read per browser process tree with psutil; without
+# psutil every browser is assumed to take BROWSER_MEMORY
+class ResourceGovernor:
+    # MB a browser is assumed to take before any could be measured
+    BROWSER_MEMORY = 400
+    # Name the drop monitor's browser is registered under
+    MONITOR = 'DropMonitor'
+
+    def __init__(self, bot):
+        self.bot = bot
+        # Browser pid -> email or 'DropMonitor', an account may run more than one browser
+        self.browsers = {}
+        # pid -> psutil.Process, kept so that cpu_percent compares with the previous sample
+        self.processes = {}
+        self.launching = 0
+        self.waiting = 0
+        self.condition = threading.Condition()
+        self.psutil = None
+        self.budget_mb = None
+        # (time, browsers, rss MB, CPU %, waiting), see sample
+        self.samples = []
+
+    # psutil is optional and only imported once the first browser is launched
+    def process_api(self):
+        if self.psutil is None:
+            try:
+                import psutil
+            except ImportError:
+                LOGGER.warning(f'psutil is not installed, assuming {self.BROWSER_MEMORY} MB per browser')
+                psutil = False
+            self.psutil = psutil
+        return self.psutil
+
+    # MB all browsers may take: MEMORY_BUDGET, or 80 % of the memory available when first asked (psutil only)
+    def budget(self):
+        if self.budget_mb is None:
+            if self.bot.MEMORY_BUDGET:
+                self.budget_mb = self.bot.MEMORY_BUDGET
+            elif self.process_api():
+                self.budget_mb = self.psutil.virtual_memory().available / 2 ** 20 * 0.8
+            else:
+                self.budget_mb = 0
+        return self.budget_mb or None
+
+    # RSS in MB and CPU % of each browser's process tree: pid -> (email, rss, cpu)
+    def measure(self):
+        with self.condition:
+            browsers = dict(self.browsers)
+        usage = {}
+        if not self.process_api():
+            return {pid: (email, self.BROWSER_MEMORY, None) for pid, email in browsers.items()}
+        processes = {}
+        for pid, email in browsers.items():
+            rss = cpu = 0.0
+            try:
+                root = self.processes.get(pid) or self.psutil.Process(pid)
+                tree = [root] + root.children(recursive=True)
+            except self.psutil.Error:
+                continue
+            for process in tree:
+                process = self.processes.get(process.pid, process)
+                try:
+                    rss += process.memory_info().rss / 2 ** 20
+                    cpu += process.cpu_percent(interval=None)
+                except self.psutil.Error:
+                    continue
+                processes[process.pid] = process
+            usage[pid] = (email, rss, cpu)
+        self.processes = processes
+        return usage
+
+    # Current usage of the browsers, the metric logged by sample and written to the run report
+    def usage(self):
+        browsers = self.measure()
+        with self.condition:
+            launching, waiting = self.launching, self.waiting
+        cpu = [browser_cpu for email, browser_rss, browser_cpu in browsers.values() if browser_cpu is not None]
+        # Browsers of the same account are added up
+        per_browser = {}
+        for email, browser_rss, browser_cpu in browsers.values():
+            entry = per_browser.setdefault(email, {'browsers': 0, 'rss_mb': 0, 'cpu_percent': None})
+            entry['browsers'] += 1
+            entry['rss_mb'] += round(browser_rss)
+            if browser_cpu is not None:
+                entry['cpu_percent'] = round((entry['cpu_percent'] or 0) + browser_cpu, 1)
+        return {
+            'browsers': len(browsers),
+            'launching': launching,
+            'waiting': waiting,
+            'rss_mb': round(sum(browser_rss for email, browser_rss, browser_cpu in browsers.values())),
+            'cpu_percent': round(sum(cpu), 1) if cpu else None,
+            'budget_mb': round(self.budget()) if self.budget() else None,
+            'per_browser': per_browser,
+        }
+
+    # Blocks until a new browser fits into the budget: the measured browsers plus the ones being launched,
+    # each of them and the new one estimated at the average browser. One browser is always admitted.
+    # Every task waiting for a drop depends on the monitor browser, so it is admitted right away and room
+    # for it is kept free while it doesn't run: account browsers, warmed ones included, never starve it
+    @contextmanager
+    def admit(self, email):
+        monitor = email == self.MONITOR
+        with self.condition:
+            self.waiting += 1
+        try:
+            queued = False
+            while True:
+                if self.bot.stopped:
+                    raise RuntimeError('Stopped while waiting for memory')
+                budget = self.budget()
+                usage = self.measure()
+                with self.condition:
+                    total = sum(rss for name, rss, cpu in usage.values())
+                    average = total / len(usage) if usage else self.BROWSER_MEMORY
+                    needed = total + (self.launching + 1) * average
+                    if not monitor and self.MONITOR not in self.browsers.values():
+                        needed += average
+                    if monitor or budget is None or needed <= budget or not (usage or self.launching):
+                        self.waiting -= 1
+                        self.launching += 1
+                        break
+                    if not queued:
+                        LOGGER.info(f'Memory budget reached ({needed:.0f} of {budget:.0f} MB), browser launch queued',
+                                    extra={'account': email})
+                        queued = True
+                    # Woken by a finished browser, memory of running ones is measured again every second
+                    self.condition.wait(timeout=1)
+        except BaseException:
+            with self.condition:
+                self.waiting -= 1
+            raise
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.launching -= 1
+                self.condition.notify_all()
+
+    # Registers a launched browser, undetected_chromedriver knows the pid of Chrome itself
+    def add(self, driver, email):
+        pid = getattr(driver, 'browser_pid', None) or driver.service.process.pid
+        with self.condition:
+            self.browsers[pid] = email
+
+    def remove(self, driver):
+        pid = getattr(driver, 'browser_pid', None) or getattr(getattr(getattr(driver, 'service', None), 'process', None), 'pid', None)
+        with self.condition:
+            self.browsers.pop(pid, None)
+            self.condition.notify_all()
+
+    # Records the current usage, called once a second while tasks run
+    def sample(self):
+        usage = self.usage()
+        self.samples.append((time.time(), usage['browsers'], usage['rss_mb'], usage['cpu_percent'], usage['waiting']))
+        return usage
+
+    # Peaks of the run for the report
+    def summary(self):
+        if not self.samples:
+            return {}
+        return {
+            'budget_mb': round(self.budget()) if self.budget() else None,
+            'peak_browsers': max(sample[1] for sample in self.samples),
+            'peak_rss_mb': max(sample[2] for sample in self.samples),
+            'peak_cpu_percent': max((sample[3] for sample in self.samples if sample[3] is not None), default=None),
+            'peak_waiting': max(sample[4] for sample in self.samples),
+        }
+
+
+# Launches and warms browsers ahead of time and hands them over to the account's task
+class DriverPool:
+    def __init__(self, bot, max_launches=4):
+        self.bot = bot
+        self.drivers = {}
+        # (launch timestamp, order, account, at) of the accounts waiting for a free slot, earliest first
+        self.queue = []
+        self.queued = 0
+        # Drivers handed over to tasks and not yet released
+        self.in_use = 0
+        self.lock = threading.Lock()
+        # Bounded so that warming many browsers at once doesn't starve the running ones
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_launches, thread_name_prefix='Warmup')
+
+    # Schedules a browser launch for the account, not before the given timestamp
+    def warm(self, account, at=None):
+        email = account["Email"]
+        with self.lock:
+            if email in self.drivers or any(queued[2]["Email"] == email for queued in self.queue):
+                return
+            self.queued += 1
+            self.queue.append((at or 0, self.queued, account, at))
+            self.queue.sort(key=lambda queued: queued[:2])
+        self.fill()
+
+    # Starts the queued launches while the warm and busy browsers leave a worker slot, plus WARM_LOOKAHEAD
+    def fill(self):
+        with self.lock:
+            while self.queue and len(self.drivers) + self.in_use < self.bot.MAX_WORKERS + self.bot.WARM_LOOKAHEAD:
+                _, _, account, at = self.queue.pop(0)
+                self.drivers[account["Email"]] = self.executor.submit(self.launch, account, at)
+
+    def launch(self, account, at=None):
+        if at is not None:
+            self.bot.wait_until(at)
+        if self.bot.stopped:
+            return None
+        self.bot.set_context(account["Email"])
+        LOGGER.info('Warming browser')
+        driver = self.bot.get_driver(account=account)
+        try:
+            # Resolve DNS, TLS and cache the static assets before the launch window
+            driver.get(self.bot.NIKE_HOME_URL)
+        except Exception:
+            # Quit the browser and free its memory budget, acquire launches a new one
+            self.bot.finish(driver)
+            raise
+        LOGGER.info('Browser is warm')
+        return driver
+
+    # Hands the warmed driver over to the account's task, launching one if it wasn't scheduled
+    def acquire(self, account):
+        email = account["Email"]
+        with self.lock:
+            future = self.drivers.pop(email, None)
+            self.queue = [queued for queued in self.queue if queued[2]["Email"] != email]
+            self.in_use += 1
+        try:
+            if future is not None:
+                try:
+                    driver = future.result()
+                except Exception as e:
+                    LOGGER.warning(f'Warming the browser failed, launching a new one: {e!r}')
+                else:
+                    if driver is None:
+                        raise RuntimeError(f'No browser for account: {email}')
+                    return driver
+            return self.bot.get_driver(account=account)
+        except BaseException:
+            self.done()
+            raise
+
+    # Takes a driver back once its task is done, the slot is free for the next task right away
+    def release(self, driver):
+        try:
+            self.bot.finish(driver)
+        finally:
+            self.done()
+
+    # A driver left its task, warm the next queued account in its place
+    def done(self):
+        with self.lock:
+            self.in_use -= 1
+        self.fill()
+
+    # Quits browsers which were warmed but never handed over
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self.lock:
+            futures, self.drivers, self.queue = list(self.drivers.values()), {}, []
+        for future in futures:
+            if not future.cancelled() and future.exception() is None and future.result() is not None:
+                self.bot.finish(future.result())
+
+
+# Watches the launch feed in a single browser and notifies every account waiting for a matching drop
+class DropMonitor:
+    def __init__(self, bot):
+        self.bot = bot
+        # (email, product URL) -> target of the products the accounts are waiting for
+        self.targets = {}
+        # Email -> event set once one of the account's products is found
+        self.events = {}
+        # Email -> [(target, item URL)] of the products found, in the order they were found
+        self.found = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    # Product URLs are matched on their last path segment, which is the same across locales
+    @staticmethod
+    def slug(url):
+        return str(url).split('?')[0].rstrip('/').rsplit('/', 1)[-1].lower()
+
+    # Registers the account's targets and returns an event which is set when the first of them drops
+    def register(self, account, targets):
+        email = account["Email"]
+        with self.lock:
+            event = self.events[email] = threading.Event()
+            for target in targets:
+                self.targets[(email, str(target["ProductURL"]))] = target
+            # The monitor browser is only started when somebody is waiting for it
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=(account,), name='DropMonitor', daemon=True)
+                self.thread.start()
+        return event
+
+    # Adds a target queued while the account is waiting, nothing happens when it isn't
+    def add(self, email, target):
+        with self.lock:
+            if email in self.events:
+                self.targets[(email, str(target["ProductURL"]))] = target
+
+    # Takes the account's target found first and the link of its product card, (None, None) when none was found
+    def take(self, email):
+        with self.lock:
+            found = self.found.get(email)
+            if not found:
+                return None, None
+            if len(found) == 1:
+                self.events[email].clear()
+            return found.pop(0)
+
+    # Stops watching one product of the account, or all of them when no URL is given
+    def unregister(self, email, product_url=None):
+        with self.lock:
+            for key in [key for key in self.targets if key[0] == email and product_url in (None, key[1])]:
+                del self.targets[key]
+            if product_url is None:
+                self.events.pop(email, None)
+                self.found.pop(email, None)
+            elif email in self.found:
+                self.found[email] = [(target, item_url) for target, item_url in self.found[email]
+                                     if str(target["ProductURL"]) != product_url]
+
+    # Matches the scanned product cards against the union of all waiting targets. The targets are the
+    # accounts' own records, titles edited in Accounts.csv are matched right away
+    def match(self, cards):
+        card_urls = {self.slug(item_url): item_url for item_title, item_url in cards if item_url}
+        with self.lock:
+            for (email, product_url), target in list(self.targets.items()):
+                product_title = str(target["ProductTitle"]).replace("'", "").lower()
+                item_url = card_urls.get(self.slug(product_url))
+                if item_url is None and product_title:
+                    item_url = next((url for title, url in cards if product_title in title), None)
+                if item_url is not None:
+                    LOGGER.info(f"Item found: {item_url}", extra={'account': email})
+                    # The card's own link: a target matched by title may only have the home URL configured
+                    self.found.setdefault(email, []).append((target, item_url))
+                    del self.targets[(email, product_url)]
+                    self.events[email].set()
+
+    def scan(self, driver):
+        self.bot.wait_until_visible(driver, css_selector='a[data-qa="product-card-link"]', duration=self.bot.TIMEOUTS['feed'])
+        return [(str(title).replace("'", "").lower(), str(url)) for title, url in driver.execute_script(SCAN_SCRIPT)['cards']]
+
+    def run(self, account):
+        self.bot.set_context('DropMonitor')
+        driver = None
+        while not self.bot.stopped:
+            try:
+                if driver is None:
+                    LOGGER.info("Starting drop monitor")
+                    driver = self.bot.get_driver(account=account, headless=True, name=ResourceGovernor.MONITOR)
+                    LOGGER.info(f'Requesting: {self.bot.SNKRS_STOCK_URL}')
+                    driver.get(self.bot.SNKRS_STOCK_URL)
+                else:
+                    driver.refresh()
+                self.match(self.scan(driver))
+            except Exception as e:
+                LOGGER.warning(f'Drop monitor failed, restarting: {e!r}')
+                if driver is not None:
+                    self.bot.finish(driver)
+                driver = None
+                self.bot.idle(1)
+            # Stop once nobody is waiting, a later register starts a new monitor
+            with self.lock:
+                if not self.targets:
+                    self.thread = None
+                    break
+        with self.lock:
+            if self.thread is threading.current_thread():
+                self.thread = None
+        if driver is not None:
+            self.bot.finish(driver)
+        LOGGER.info("Drop monitor stopped")
+
+
+# Calls back when URL.txt or Accounts.csv change. Uses the file system notifications of the OS through
+# watchdog (inotify, ReadDirectoryChangesW, FSEvents); without watchdog it falls back to checking mtimes
+class FileWatcher:
+    # Editors write a file in several steps, changes within this many seconds are handled once
+    DEBOUNCE = 0.05
+
+    def __init__(self, paths, callback):
+        self.paths = {str(Path(path).resolve()): path for path in paths}
+        self.callback = callback
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.observer = None
+        self.stopped = threading.Event()
+
+    def changed(self, path):
+        path = str(Path(path).resolve())
+        if path not in self.paths:
+            return
+        with self.lock:
+            if path in self.timers:
+                self.timers[path].cancel()
+            self.timers[path] = threading.Timer(self.DEBOUNCE, self.callback, args=(self.paths[path],))
+            self.timers[path].daemon = True
+            self.timers[path].start()
+
+    def start(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            LOGGER.warning('watchdog is not installed, checking the watched files every second instead')
+            threading.Thread(target=self.poll, name='FileWatcher', daemon=True).start()
+            return self
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                for path in (event.src_path, getattr(event, 'dest_path', None)):
+                    if path:
+                        watcher.changed(path)
+
+        self.observer = Observer()
+        for directory in {str(Path(path).parent) for path in self.paths}:
+            self.observer.schedule(Handler(), directory, recursive=False)
+        self.observer.daemon = True
+        self.observer.start()
+        return self
+
+    def poll(self):
+        mtimes = {path: self.mtime(path) for path in self.paths}
+        while not self.stopped.wait(1):
+            for path in self.paths:
+                mtime = self.mtime(path)
+                if mtime != mtimes[path]:
+                    mtimes[path] = mtime
+                    self.changed(path)
+
+    @staticmethod
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def stop(self):
+        self.stopped.set()
+        if self.observer is not None:
+            self.observer.stop()
+
 
 class SNKRsBot:
+    # URL patterns blocked through the DevTools protocol, selected by BLOCKING_PROFILE. Scripts and
+    # API calls of nike.com itself are never blocked, checkout and the bot protection depend on them
+    BLOCKING_PROFILES = {
+        'off': [],
+        'checkout': [
+            # Product imagery and video
+            '*.jpg', '*.jpeg', '*.png', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+            '*.mp4', '*.webm', '*.m3u8', '*.ts',
+            # Fonts
+            '*.woff', '*.woff2', '*.ttf', '*.otf',
+            # Third-party analytics and marketing
+            '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+            '*facebook.com/tr*', '*hotjar.com*', '*optimizely.com*', '*newrelic.com*', '*nr-data.net*',
+            '*branch.io*', '*bing.com*', '*tiktok.com*', '*snapchat.com*', '*pinterest.com*',
+        ],
+    }
+
+    # Seconds to wait for an element, per stage of a task
+    TIMEOUTS = {
+        'page': 15,       # Any page to render after driver.get
+        'session': 5,     # Account menu after restoring a cookie session
+        'login': 20,      # Each step of the credentials sign-in
+        'cart': 5,        # Cart items and the add-to-cart button
+        'product': 10,    # Size grid and add-to-cart on the product page
+        'checkout': 15,   # Each step of shipping, payment and order review
+        'feed': 30,       # Product cards on the launch feed
+        'confirm': 60,    # Order confirmation after the order was placed
+    }
+
+    # Stages of buying a target, see buy_target. The last completed one is saved per account and product,
+    # a restarted task resumes after it instead of clearing the cart and waiting for the drop again
+    STAGES = ('logged_in', 'cart_cleared', 'item_carted', 'shipping_set', 'card_added', 'order_placed')
+
     def __init__(self):
         self.stopped = False
+        # Upper bound of accounts (browsers) running at the same time
+        self.MAX_WORKERS = 10
+        # Per-task status: Email -> Pending, Running, Done, Failed or Cancelled
+        self.task_status = {}
+        self.status_lock = threading.Lock()
+        self.futures = {}
+        # Stage and WebDriver command timings, exported to SNKRsRes/Reports after the run
+        self.timings = Timings()
+        # Browsers are launched this many seconds before the account's LoginTime
+        self.WARMUP_LEAD = 60
+        # Browsers warmed beyond the ones MAX_WORKERS tasks use, the other accounts are warmed as tasks finish
+        self.WARM_LOOKAHEAD = 2
+        self.driver_pool = DriverPool(self)
+        # MB the browsers may take together, None for 80 % of the memory available at the first launch
+        self.MEMORY_BUDGET = None
+        self.governor = ResourceGovernor(self)
+        # Shard -> ResourceGovernor.summary of the shard processes, see run_sharded
+        self.shard_resources = {}
+        # Difference to NTP time, see get_clock_offset
+        self.clock_offset = None
+        # The product page is loaded this many seconds before the ReleaseTime
+        self.STAGE_LEAD = 30
+        # One monitor browser watches the launch feed for all accounts
+        self.drop_monitor = DropMonitor(self)
+        # A session verified this many seconds ago is trusted without loading a page
+        self.SESSION_TRUST = 1800
+        # Sessions expiring before a release are renewed this many seconds before it
+        self.SESSION_REFRESH_LEAD = 600
+        # Names of the cookies whose expiry ends a session, if empty all persistent cookies but the
+        # tracking and bot-protection ones (SessionStore.IGNORED_COOKIES)
+        self.SESSION_COOKIES = ()
+        # Run the account browsers headless
+        self.HEADLESS = False
+        # Resources not needed to buy (see BLOCKING_PROFILES) are dropped before they are requested
+        self.BLOCKING_PROFILE = 'checkout'
+        # Record bytes transferred and page-load time after every stage (one extra script call per stage)
+        self.MEASURE_PAGES = False
+        # Shown once an order went through, checked in the background after place_order
+        self.ORDER_CONFIRMATION = '[data-qa="order-confirmation"]'
+        # Email -> ProductURL -> Confirmed, Unconfirmed, Placed earlier, Not placed or Failed
+        self.order_results = {}
+        self.confirm_executor = None
+        # Keep running and pick up changes of URL.txt and Accounts.csv while the bot runs
+        self.WATCH_FILES = False
+        self.executor = None
+        # Email -> Account of the running accounts
+        self.accounts = {}
+        # Product URLs already read from URL.txt
+        self.known_urls = set()
+        # Seconds from the first failed stage of a target until its stages are no longer retried
+        self.STAGE_BUDGET = 60
+        # Seconds between two attempts of a failed stage
+        self.STAGE_RETRY_DELAY = 1
+        # Saved stages older than this are not resumed, the cart may have expired meanwhile
+        self.CHECKPOINT_TTL = 1800
+        # Worker processes the accounts are split across, each with up to MAX_WORKERS browsers and its own
+        # drop monitor. With more than one, URL.txt and Accounts.csv are not reloaded at run time
+        self.PROCESSES = 1
+        # Set in shard processes: status and results are sent to the coordinator, see run_shard
+        self.events = None
+        # Set in the coordinator while shards run, stop() sets it
+        self.stop_event = None
         self.PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
         self.PROJECT_ROOT = Path(self.PROJECT_ROOT)
         # start_date = str((datetime.now() - timedelta(7)).strftime('%m/%d/%Y'))
@@ -82,12 +1049,15 @@ class SNKRsBot:
         self.file_path_accounts = str(self.PROJECT_ROOT / 'SNKRsRes/Accounts.csv')
         self.file_path_proxies = str(self.PROJECT_ROOT / 'SNKRsRes/proxies.txt')
         self.file_path_uagents = str(self.PROJECT_ROOT / 'SNKRsRes/user_agents.txt')
+        self.file_path_urls = str(self.PROJECT_ROOT / 'SNKRsRes/URL.txt')
         self.NIKE_HOME_URL = "https://www.nike.com"
         self.SNKRS_HOME_URL = "https://www.nike.com/launch"
         self.SNKRS_STOCK_URL = "https://www.nike.com"
         self.NIKE_PROFILE_URL = "https://www.nike.com/member/profile/"
         self.NIKE_CART_URL = "https://www.nike.com/cart"
         self.NIKE_CHECKOUT_URL = "https://www.nike.com/checkout"
+        self.session_store = SessionStore(self.PROJECT_ROOT / 'SNKRsRes/Sessions.db', legacy_dir=self.PROJECT_ROOT / 'SNKRsRes',
+                                          cookie_names=self.SESSION_COOKIES)
 
     @staticmethod
     def enable_cmd_colors():
@@ -98,25 +1068,51 @@ class SNKRsBot:
             kernel32 = ctypes.windll.kernel32
             kernel32.SetConsoleMode(kernel32.GetStdHandle(-11), 7)
 
-    # Trial logic
+    # Queries the NTP pool
     @staticmethod
-    def trial(trial_date):
+    def ntp_request():
+        import ntplib
         ntp_client = ntplib.NTPClient()
+        return ntp_client.request('pool.ntp.org')
+
+    # Trial logic
+    @classmethod
+    def trial(cls, trial_date):
         try:
-            response = ntp_client.request('pool.ntp.org')
+            response = cls.ntp_request()
             local_time = time.localtime(response.ref_time)
             current_date = time.strftime('%Y-%m-%d %H:%M:%S', local_time)
             current_date = datetime.strptime(current_date, '%Y-%m-%d %H:%M:%S')
             return trial_date > current_date
-        except:
-            pass
+        except Exception as e:
+            LOGGER.warning(f'Trial check failed: {e!r}')
+            return False
+
+    # Offset in seconds between the local clock and NTP time, measured once per run
+    def get_clock_offset(self):
+        if self.clock_offset is not None:
+            return self.clock_offset
+        with self.status_lock:
+            if self.clock_offset is None:
+                try:
+                    self.clock_offset = self.ntp_request().offset
+                    LOGGER.info(f'Clock offset to NTP: {self.clock_offset * 1000:.1f} ms')
+                except Exception as e:
+                    LOGGER.warning(f'NTP sync failed, using the local clock: {e!r}')
+                    self.clock_offset = 0.0
+            return self.clock_offset
+
+    # Current NTP-corrected time
+    def now(self):
+        return time.time() + self.get_clock_offset()
 
     # Get user agent
     def get_user_agent(self, account_num):
         with open(self.file_path_uagents) as f:
             content = f.readlines()
-        u_agents_list = [x.strip() for x in content]
-        return u_agents_list[int(account_num)]
+        u_agents_list = [x.strip() for x in content if x.strip()]
+        # More accounts than user agents share them round-robin
+        return u_agents_list[int(account_num) % len(u_agents_list)]
 
     # Get proxy
     def get_proxy(self, account_num):
@@ -125,8 +1121,9 @@ class SNKRsBot:
         proxies_list = [x.strip() for x in content]
         return proxies_list[int(account_num)]
 
-    # Get web driver
-    def get_driver(self, account, headless=False):
+    # Get web driver, counted against the memory budget under name (default: the account's email)
+    def get_driver(self, account, headless=None, name=None):
+        import undetected_chromedriver as uc
         account_num = str(account["AccountNo"]).strip()
         proxy = account["Proxy"]
         LOGGER.info(f'Launching chrome browser')
@@ -150,63 +1147,138 @@ class SNKRsBot:
         options.add_argument(f'--user-agent={self.get_user_agent(account_num)}')
         # if proxy != "No":
         #     options.add_argument(f"--proxy-server={proxy}")
-        if headless:
+        if self.HEADLESS if headless is None else headless:
             options.add_argument('--headless')
-        driver = uc.Chrome(executable_path=driver_BIN, options=options)
+        # Waits while the browsers already running take up the memory budget
+        name = name or account["Email"]
+        with self.governor.admit(name):
+            with self.timings.span('get_driver', account=account["Email"]):
+                driver = uc.Chrome(executable_path=driver_BIN, options=options)
+            self.governor.add(driver, name)
+        self.time_commands(driver)
+        driver.set_script_timeout(SCRIPT_TIMEOUT)
+        blocked_urls = self.BLOCKING_PROFILES[self.BLOCKING_PROFILE or 'off']
+        if blocked_urls:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls})
         return driver
 
+    # Records the weight and load time of the page a stage ended on
+    def measure_page(self, driver, stage):
+        if not self.MEASURE_PAGES:
+            return
+        try:
+            stats = driver.execute_script(PAGE_STATS_SCRIPT)
+        except Exception as e:
+            LOGGER.info(f'Page stats unavailable after {stage}: {e!r}')
+            return
+        self.timings.record_page(stage, stats['bytes'], stats['load_ms'])
+
+    # Records every WebDriver command as a span nested in the stage that sent it
+    def time_commands(self, driver):
+        execute = driver.execute
+
+        def timed_execute(driver_command, params=None):
+            with self.timings.span(f'cmd:{driver_command}'):
+                return execute(driver_command, params)
+        driver.execute = timed_execute
+
     # Finish and quit browser
     def finish(self, driver):
         LOGGER.info(f'Quiting the browser instance')
         try:
             driver.close()
             driver.quit()
-        except:
-            LOGGER.info(f'Issue while quiting the browser instance')
+        except Exception as e:
+            LOGGER.info(f'Issue while quiting the browser instance: {e!r}')
+        finally:
+            # Lets the next queued browser launch
+            self.governor.remove(driver)
 
-    # Waits for an element
+    # Waits for an element inside the page and returns it: a MutationObserver resolves the
+    # async script as soon as the element is visible (and enabled), so it takes one round-trip
     @staticmethod
-    def wait_until_visible(driver, xpath=None, element_id=None, name=None, class_name=None, tag_name=None, css_selector=None, duration=10000, frequency=0.01):
+    def wait_until_visible(driver, xpath=None, element_id=None, name=None, class_name=None, tag_name=None, css_selector=None, duration=10, clickable=True):
+        from selenium.common.exceptions import JavascriptException, TimeoutException
         if xpath:
-            WebDriverWait(driver, duration, frequency).until(EC.element_to_be_clickable((By.XPATH, xpath)))
+            by, selector = 'xpath', xpath
         elif element_id:
-            WebDriverWait(driver, duration, frequency).until(EC.element_to_be_clickable((By.ID, element_id)))
+            by, selector = 'css', f'[id="{element_id}"]'
         elif name:
-            WebDriverWait(driver, duration, frequency).until(EC.element_to_be_clickable((By.NAME, name)))
+            by, selector = 'css', f'[name="{name}"]'
         elif class_name:
-            WebDriverWait(driver, duration, frequency).until(
-                EC.element_to_be_clickable((By.CLASS_NAME, class_name)))
+            by, selector = 'css', f'.{class_name}'
         elif tag_name:
-            WebDriverWait(driver, duration, frequency).until(
-                EC.visibility_of_element_located((By.TAG_NAME, tag_name)))
-        elif css_selector:
-            WebDriverWait(driver, duration, frequency).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, css_selector)))
-
-    # Login to the nike account
-    def login_nike(self, driver, account):
+            # Tags were only required to be visible
+            by, selector, clickable = 'css', tag_name, False
+        else:
+            by, selector = 'css', css_selector
+        deadline = time.monotonic() + duration
+        while True:
+            # A single script call can't outlive the driver's script timeout
+            remaining = min(deadline - time.monotonic(), SCRIPT_TIMEOUT - 1)
+            if remaining <= 0:
+                raise TimeoutException(f'Element not visible after {duration} s: {selector}')
+            try:
+                element = driver.execute_async_script(WAIT_SCRIPT, by, selector, clickable, int(remaining * 1000))
+            except JavascriptException as e:
+                # The page navigated away while waiting, wait again in the new document once it started loading.
+                # Anything else, like an invalid selector, fails the same way on every call
+                if not any(message in str(e) for message in NAVIGATION_ERRORS):
+                    raise
+                sleep(0.05)
+                continue
+            if element is not None:
+                return element
+
+    # Fills a whole form in one script call, raises NoSuchElementException naming the failed field
+    @staticmethod
+    def fill_form(driver, fields, clicks=()):
+        from selenium.common.exceptions import NoSuchElementException
+        failed = driver.execute_script(FILL_SCRIPT, [[selector, str(value)] for selector, value in fields.items()], list(clicks))
+        if failed:
+            raise NoSuchElementException(f'Form field not found: {failed}')
+
+    # Sets cookies through the DevTools protocol, which unlike add_cookie needs no page of the domain to be loaded
+    @staticmethod
+    def set_cookies(driver, cookies):
+        params = []
+        for cookie in cookies:
+            param = {key: cookie[key] for key in ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite') if key in cookie}
+            if 'expiry' in cookie:
+                param['expires'] = cookie['expiry']
+            params.append(param)
+        driver.execute_cdp_cmd('Network.setCookies', {'cookies': params})
+
+    # Login to the nike account, raises a WebDriverException when signing in failed
+    def login_nike(self, driver, account, force=False):
+        from selenium.common.exceptions import TimeoutException, WebDriverException
         email = str(account["Email"]).strip()
         password = str(account["Password"]).strip()
-        LOGGER.info(f'Signing-in to Nike account: {email}')
-        cookies = 'Cookies_' + email + '.pkl'
-        cookies_file_path = self.PROJECT_ROOT / 'SNKRsRes' / cookies
-        # Try signing-in via cookies
-        if os.path.isfile(cookies_file_path):
-            LOGGER.info(f'Requesting: {str(self.NIKE_HOME_URL)}: account: {email}')
+        LOGGER.info('Signing-in to Nike account')
+        session = None if force else self.session_store.get(email)
+        # Sessions which are expired or failed before are skipped without touching the browser
+        if session is not None and not self.session_store.is_alive(email):
+            LOGGER.info('Stored session is expired')
+        elif session is not None:
+            cookies, expires, verified, dead = session
+            LOGGER.info('Loading cookies')
+            self.set_cookies(driver, cookies)
+            if verified is not None and time.time() - verified < self.SESSION_TRUST:
+                LOGGER.info('Cookies login successful (verified recently)')
+                return True
+            LOGGER.info(f'Requesting: {str(self.NIKE_HOME_URL)}')
             driver.get(self.NIKE_HOME_URL)
-            LOGGER.info(f'Loading cookies ... Account: {email}')
-            with open(cookies_file_path, 'rb') as cookies_file:
-                cookies = pickle.load(cookies_file)
-            for cookie in cookies:
-                driver.add_cookie(cookie)
             try:
                 # Wait for profile to become visible
-                self.wait_until_visible(driver=driver, css_selector='#AccountMenu', duration=5)
-                LOGGER.info(f'Cookies login successful ... Account: {email}')
-                # driver.refresh()
+                self.wait_until_visible(driver=driver, css_selector='#AccountMenu', duration=self.TIMEOUTS['session'])
+                LOGGER.info('Cookies login successful')
+                self.session_store.mark_verified(email)
                 return True
-            except:
-                LOGGER.info(f'Cookies login failed ... Account: {email}')
+            except TimeoutException:
+                LOGGER.info('Cookies login failed')
+                self.session_store.mark_dead(email)
+                driver.delete_all_cookies()
                 # self.captcha_login(email=email, password=password)
         # Try logout
         # try:
@@ -218,59 +1290,56 @@ class SNKRsBot:
         # except:
         #     pass
         # Try sign-in normally using credentials
-        LOGGER.info(f"Logging in using credentials: account: {email}")
+        LOGGER.info("Logging in using credentials")
         try:
-            LOGGER.info(f"Waiting for login: account: {email}")
-            LOGGER.info(f'Requesting: {str(self.SNKRS_STOCK_URL)} account: {email}')
+            LOGGER.info("Waiting for login")
+            LOGGER.info(f'Requesting: {str(self.SNKRS_STOCK_URL)}')
             driver.get(self.SNKRS_STOCK_URL)
             # Wait and click login button
             # self.wait_until_visible(driver=driver, css_selector='button[type="button"]')
             # driver.find_element_by_css_selector('button[type="button"]').click()
-            self.wait_until_visible(driver=driver, css_selector='button[data-path="sign in"]')
-            driver.find_element_by_css_selector('button[data-path="sign in"]').click()
-            LOGGER.info(f'Filling email: account: {email}')
-            self.wait_until_visible(driver=driver, css_selector='input[type="email"]')
-            email_input = driver.find_element_by_css_selector('input[type="email"]')
+            self.wait_until_visible(driver=driver, css_selector='button[data-path="sign in"]', duration=self.TIMEOUTS['login']).click()
+            LOGGER.info('Filling email')
+            email_input = self.wait_until_visible(driver=driver, css_selector='input[type="email"]', duration=self.TIMEOUTS['login'])
             email_input.clear()
             email_input.send_keys(email)
-            LOGGER.info(f'Filling password: account: {email}')
+            LOGGER.info('Filling password')
             password_input = driver.find_element_by_css_selector('input[type="password"]')
             password_input.clear()
             password_input.send_keys(password)
             driver.find_element_by_css_selector('input[type="button"]').click()
-            LOGGER.info(f'Credentials submitted: account: {email}')
-            LOGGER.info(f'Waiting for user profile: account: {email}')
-            self.wait_until_visible(driver=driver, css_selector='span[data-qa="user-name"]')
-            use_name = driver.find_element_by_css_selector('span[data-qa="user-name"]').text
+            LOGGER.info('Credentials submitted')
+            LOGGER.info('Waiting for user profile')
+            use_name = self.wait_until_visible(driver=driver, css_selector='span[data-qa="user-name"]', duration=self.TIMEOUTS['login']).text
             LOGGER.info(f'UserName: {use_name}')
             LOGGER.info('Successful sign-in')
             # Store user cookies for later use
-            LOGGER.info(f'Saving cookies for: Account: {email}')
-            with open(cookies_file_path, 'wb') as cookies_file:
-                pickle.dump(driver.get_cookies(), cookies_file)
-            LOGGER.info(f'Cookies have been saved: Account: {email}')
+            LOGGER.info('Saving cookies')
+            self.session_store.save(email, driver.get_cookies(), verified=time.time())
+            LOGGER.info('Cookies have been saved')
             return True
-        except:
-            pass
+        except WebDriverException as e:
+            LOGGER.warning(f'Sign-in failed: {e!r}')
+            raise
 
     # Removes cart items
     def empty_cart(self, driver, email):
+        from selenium.common.exceptions import TimeoutException
         try:
-            LOGGER.info(f'Requesting: {self.NIKE_CART_URL} account: {email}')
+            LOGGER.info(f'Requesting: {self.NIKE_CART_URL}')
             driver.get(self.NIKE_CART_URL)
-            self.wait_until_visible(driver=driver, css_selector='h4')
-            LOGGER.info(f"Waiting for cart empty message to become visible: account: {email}")
-            self.wait_until_visible(driver=driver, css_selector='button[name="remove-item-button"]', duration=3)
-            driver.find_element_by_css_selector('button[name="remove-item-button"]').click()
-            self.wait_until_visible(driver=driver, css_selector='p[data-automation="no-items"]', duration=5)
-            LOGGER.info(f"Cart has been cleared: account: {email}")
-        except:
-            LOGGER.info(f"Cart has no item: account: {email}")
+            self.wait_until_visible(driver=driver, css_selector='h4', duration=self.TIMEOUTS['page'])
+            LOGGER.info("Waiting for cart empty message to become visible")
+            self.wait_until_visible(driver=driver, css_selector='button[name="remove-item-button"]', duration=self.TIMEOUTS['cart']).click()
+            self.wait_until_visible(driver=driver, css_selector='p[data-automation="no-items"]', duration=self.TIMEOUTS['cart'])
+            LOGGER.info("Cart has been cleared")
+        except TimeoutException:
+            LOGGER.info("Cart has no item")
 
     def select_shoes_color(self, driver, account):
         shoes_color = account["ShoesColor"]
         LOGGER.info("Waiting for color grid to become visible:")
-        self.wait_until_visible(driver=driver, xpath='//*[@id="ColorwayDiv"]/div/div')
+        self.wait_until_visible(driver=driver, xpath='//*[@id="ColorwayDiv"]/div/div', duration=self.TIMEOUTS['product'])
         LOGGER.info("Selecting color from the color grid:")
         LOGGER.info(f"Color to be selected: {shoes_color}")
         for color in driver.find_elements_by_css_selector('.colorway-anchor.noGrayOverlayColor'):
@@ -281,46 +1350,42 @@ class SNKRsBot:
             else:
                 continue
 
-    def add_to_cart(self, driver, account):
+    # Selects the first available size and adds the item, False when none of the sizes is available
+    def add_to_cart(self, driver, account, target):
         LOGGER.info(f"Adding item to cart")
-        shoes_sizes = str(account["ShoesSizes"]).split(':')
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.action_chains import ActionChains
+        from selenium.webdriver.common.keys import Keys
+        shoes_sizes = target["ShoesSizes"]
         email = account["Email"]
         actions = ActionChains(driver)
         # Scroll to the Add-To-Cart button
         try:
-            self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark btn-lg capitalize']", duration=5)
-        except:
+            self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark btn-lg capitalize']", duration=self.TIMEOUTS['cart'])
+        except TimeoutException:
             pass
         driver.find_element_by_tag_name('html').send_keys(Keys.SPACE)
         driver.find_element_by_tag_name('html').send_keys(Keys.SPACE)
-        try:
-            LOGGER.info(f"Waiting for cart button: account: {email}")
-            self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark btn-lg capitalize']", duration=10)
-            cart_btn = driver.find_element_by_css_selector("button[class='ncss-btn-primary-dark btn-lg capitalize']")
-            actions.move_to_element(cart_btn)
-        except:
-            return False
+        LOGGER.info("Waiting for cart button")
+        cart_btn = self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark btn-lg capitalize']", duration=self.TIMEOUTS['product'])
+        actions.move_to_element(cart_btn)
         # LOGGER.info("Waiting for size grid to become clickable:" + ' Account No. ' + str(account_num))
         LOGGER.info("Selecting size")
-        # Select shoes size
-        for shoes_size in shoes_sizes:
-            LOGGER.info("Size to be selected:" + str(shoes_size))
-            for size in driver.find_elements_by_css_selector('li[data-qa="size-available"]'):
-                LOGGER.info(f"Item size: {size.text}")
-                if str(size.text).strip() == shoes_size:
-                    size.click()
-                    LOGGER.info(f"Size has been selected: {str(size.text).strip()}")
-                    break
-                else:
-                    continue
+        # Select the first available shoes size in the account's priority order
+        available = {size_text: size for size_text, size in driver.execute_script(SCAN_SCRIPT)['sizes']}
+        LOGGER.info(f"Available sizes: {', '.join(available)}")
+        shoes_size = next((shoes_size for shoes_size in shoes_sizes if shoes_size in available), None)
+        if shoes_size is None:
+            LOGGER.info(f"None of the sizes is available: {', '.join(shoes_sizes)}")
+            return False
+        available[shoes_size].click()
+        LOGGER.info(f"Size has been selected: {shoes_size}")
         LOGGER.info("Adding to cart:")
-        self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark btn-lg capitalize']", duration=10)
-        driver.find_element_by_css_selector("button[class='ncss-btn-primary-dark btn-lg capitalize']").click()
-        self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark']")
-        driver.find_element_by_css_selector("button[class='ncss-btn-primary-dark']").click()
+        self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark btn-lg capitalize']", duration=self.TIMEOUTS['product']).click()
+        self.wait_until_visible(driver, css_selector="button[class='ncss-btn-primary-dark']", duration=self.TIMEOUTS['product']).click()
         LOGGER.info("Waiting for checkout page")
-        self.wait_until_visible(driver, css_selector="h1", duration=10)
-        LOGGER.info(f"Item has been added to cart: {email}")
+        self.wait_until_visible(driver, css_selector="h1", duration=self.TIMEOUTS['page'])
+        LOGGER.info("Item has been added to cart")
         return True
 
     # Change shipping details
@@ -330,38 +1395,26 @@ class SNKRsBot:
         address = account["Address"]
         email = account["Email"]
         phone = account["Phone"]
-        LOGGER.info(f"Editing shipping details: {email}")
-        self.wait_until_visible(driver, css_selector='a[aria-label="Edit Shipping"]')
-        driver.find_element_by_css_selector('a[aria-label="Edit Shipping"]').click()
-        self.wait_until_visible(driver, css_selector='button[class="ncss-btn-clear u-underline"]')
-        driver.find_element_by_css_selector('button[class="ncss-btn-clear u-underline"]').click()
-        self.wait_until_visible(driver, css_selector='[id="firstName"]')
-        f_name = driver.find_element_by_css_selector('[id="firstName"]')
-        f_name.clear()
-        f_name.send_keys(first_name)
-        l_name = driver.find_element_by_css_selector('[id="lastName"]')
-        l_name.clear()
-        l_name.send_keys(last_name)
-        addr = driver.find_element_by_css_selector('[id="address1"]')
-        addr.clear()
-        addr.send_keys(address)
-        e_mail = driver.find_element_by_css_selector('[id="email"]')
-        e_mail.clear()
-        e_mail.send_keys(email)
-        phone_num = driver.find_element_by_css_selector('[id="phoneNumber"]')
-        phone_num.clear()
-        phone_num.send_keys(phone)
+        LOGGER.info("Editing shipping details")
+        self.wait_until_visible(driver, css_selector='a[aria-label="Edit Shipping"]', duration=self.TIMEOUTS['checkout']).click()
+        self.wait_until_visible(driver, css_selector='button[class="ncss-btn-clear u-underline"]', duration=self.TIMEOUTS['checkout']).click()
+        self.wait_until_visible(driver, css_selector='[id="firstName"]', duration=self.TIMEOUTS['checkout'])
         LOGGER.info("Saving changes")
-        # Save change
-        driver.find_element_by_css_selector('button[type="submit"]').click()
+        # Fill the shipping form and save the change
+        self.fill_form(driver, {
+            '[id="firstName"]': first_name,
+            '[id="lastName"]': last_name,
+            '[id="address1"]': address,
+            '[id="email"]': email,
+            '[id="phoneNumber"]': phone,
+        }, clicks=['button[type="submit"]'])
         # Continue to Payment
-        self.wait_until_visible(driver, css_selector='button[type="button"]')
-        driver.find_element_by_css_selector('button[type="button"]').click()
+        self.wait_until_visible(driver, css_selector='button[type="button"]', duration=self.TIMEOUTS['checkout']).click()
         # Continue to order
+        from selenium.common.exceptions import TimeoutException
         try:
-            self.wait_until_visible(driver, css_selector='button[data-attr="continueToOrderReviewBtn"]')
-            driver.find_element_by_css_selector('button[data-attr="continueToOrderReviewBtn"]').click()
-        except:
+            self.wait_until_visible(driver, css_selector='button[data-attr="continueToOrderReviewBtn"]', duration=self.TIMEOUTS['checkout']).click()
+        except TimeoutException:
             pass
 
     # Add a new payment card
@@ -369,96 +1422,689 @@ class SNKRsBot:
         card_num = account["CardNumber"]
         expiry = account["CardExpiry"]
         cvv = account["CVV"]
+        from selenium.webdriver.common.keys import Keys
         driver.find_element_by_tag_name('html').send_keys(Keys.END)
         LOGGER.info("Adding new card")
         # Click Edit button under Payment
-        self.wait_until_visible(driver, css_selector='a[aria-label="Edit Payment"]')
-        driver.find_element_by_css_selector('a[aria-label="Edit Payment"]').click()
+        self.wait_until_visible(driver, css_selector='a[aria-label="Edit Payment"]', duration=self.TIMEOUTS['checkout']).click()
         # Add New card
-        self.wait_until_visible(driver=driver, css_selector='[id="newCard"]')
-        driver.find_element_by_css_selector('[id="newCard"]').click()
-        # Enter card number
-        self.wait_until_visible(driver=driver, css_selector='[id="creditCardNumber"]')
-        driver.find_element_by_css_selector('[id="creditCardNumber"]').send_keys(card_num)
-        # Enter Expiration date
-        driver.find_element_by_css_selector('[id="expirationDate"]').send_keys(expiry)
-        # select state by visible text
-        driver.find_element_by_css_selector('[id="cvNumber"]').send_keys(cvv)
-        driver.find_element_by_css_selector('[for="saveCreditCardData"]').click()
+        self.wait_until_visible(driver=driver, css_selector='[id="newCard"]', duration=self.TIMEOUTS['checkout']).click()
+        self.wait_until_visible(driver=driver, css_selector='[id="creditCardNumber"]', duration=self.TIMEOUTS['checkout'])
+        # Enter card number, expiration date and CVV, save the card and use it
         LOGGER.info("Click add new card button:")
-        driver.find_element_by_css_selector('.test-payment-use-card').click()
-        self.wait_until_visible(driver, css_selector='button[data-attr="continueToOrderReviewBtn"]')
-        driver.find_element_by_css_selector('button[data-attr="continueToOrderReviewBtn"]').click()
+        self.fill_form(driver, {
+            '[id="creditCardNumber"]': card_num,
+            '[id="expirationDate"]': expiry,
+            '[id="cvNumber"]': cvv,
+        }, clicks=['[for="saveCreditCardData"]', '.test-payment-use-card'])
+        self.wait_until_visible(driver, css_selector='button[data-attr="continueToOrderReviewBtn"]', duration=self.TIMEOUTS['checkout']).click()
 
     # Place order
-    def place_order(self, driver, cvv):
+    # Place order. sent['at'] is set right before the submit click, from then on the order may have gone out
+    def place_order(self, driver, cvv, sent=None):
+        from selenium.webdriver.common.keys import Keys
         driver.find_element_by_tag_name('html').send_keys(Keys.END)
-        try:
-            # Enter card CVV number
-            self.wait_until_visible(driver, css_selector='[id="cvNumber"]')
-            driver.find_element_by_css_selector('[id="cvNumber"]').send_keys(cvv)
-            # Continue to order
-            self.wait_until_visible(driver, css_selector='button[data-attr="continueToOrderReviewBtn"]')
-            driver.find_element_by_css_selector('button[data-attr="continueToOrderReviewBtn"]').click()
-            return True
-        except:
-            return False
+        # Enter card CVV number
+        self.wait_until_visible(driver, css_selector='[id="cvNumber"]', duration=self.TIMEOUTS['checkout']).send_keys(cvv)
+        # Continue to order
+        submit = self.wait_until_visible(driver, css_selector='button[data-attr="continueToOrderReviewBtn"]', duration=self.TIMEOUTS['checkout'])
+        if sent is not None:
+            sent['at'] = time.time()
+        submit.click()
+        return True
 
-    # Get a new drop
-    def get_drop(self, driver, account):
+    # Get a new drop: the shared drop monitor watches the target and every other queued target of the account
+    # without a ReleaseTime. Opens and returns the link of the product card of the one found first, which
+    # becomes the account's current target, see switch_target
+    def get_drop(self, driver, account, target):
         LOGGER.info("Getting new drop")
         email = account["Email"]
-        product_title = str(account["ProductTitle"]).lower()
-        product_url = account["ProductURL"]
-        LOGGER.info(f'Requesting: {self.SNKRS_STOCK_URL} account: {email}')
-        driver.get(self.SNKRS_STOCK_URL)
-        # Stay and continuously look for a drop
-        while True:
-            # Wait for items to be visible
-            LOGGER.info("Waiting for items")
-            self.wait_until_visible(driver, css_selector='a[data-qa="product-card-link"]')
-            for item in driver.find_elements_by_css_selector('a[data-qa="product-card-link"]'):
-                item_title = str(item.get_attribute('aria-label')).replace("'", "").lower()
-                item_url = item.get_attribute('aria-label')
-                if product_title in item_title or product_url in item_url:
-                    LOGGER.info(f"Item found: {product_url}")
+        with self.status_lock:
+            waiting = [target] + [queued for queued in account.Targets if queued["ReleaseTime"] is None]
+        # An order placed before a restart is not placed again
+        waiting = [queued for queued in waiting if queued is target or self.session_store.last_stage(
+            email, queued["ProductURL"], max_age=self.CHECKPOINT_TTL) != 'order_placed']
+        found = self.drop_monitor.register(account, waiting)
+        try:
+            # Stay and wait for the monitor to see the drop
+            while not self.stopped:
+                if found.wait(timeout=1):
+                    dropped, product_url = self.drop_monitor.take(email)
+                    # Unless it was withdrawn in the meantime
+                    if dropped is None or not self.switch_target(account, dropped):
+                        continue
                     LOGGER.info(f"Requesting item: {product_url}")
                     driver.get(product_url)
-                    return True
-            driver.refresh()
+                    return product_url
+                # A scheduled target queued in the meantime needs the browser for its release
+                with self.status_lock:
+                    scheduled = [queued for queued in account.Targets if queued["ReleaseTime"] is not None]
+                if any(self.now() >= self.due_time(email, queued) for queued in scheduled):
+                    with self.status_lock:
+                        LOGGER.info(f'Scheduled release is due, queued again: {account.Current["ProductURL"]}')
+                        account.add_target(account.Current)
+                        account.Current = None
+                    return None
+            return None
+        finally:
+            self.drop_monitor.unregister(email)
+
+    # When a scheduled target needs the account's browser: STAGE_LEAD before its product page is staged or its
+    # session is renewed, which leaves the time to sign in and clear the cart
+    def due_time(self, email, target):
+        release_time = target["ReleaseTime"]
+        alive = self.session_store.is_alive(email, at=release_time + self.SESSION_REFRESH_LEAD)
+        return release_time - (self.STAGE_LEAD if alive else self.SESSION_REFRESH_LEAD) - self.STAGE_LEAD
+
+    # Makes a queued target that dropped first the account's current target, the current one is queued again.
+    # Returns False when the target is neither current nor queued anymore
+    def switch_target(self, account, target):
+        with self.status_lock:
+            if target is account.Current:
+                return True
+            if target not in account.Targets:
+                return False
+            LOGGER.info(f'Dropped first: {target["ProductURL"]}')
+            account.Targets.remove(target)
+            if account.Current is not None:
+                account.add_target(account.Current)
+            account.Current = target
+            return True
+
+    # Sleeps in short steps so a stopped bot doesn't wait for the full duration
+    def idle(self, seconds):
+        deadline = time.monotonic() + seconds
+        while not self.stopped and time.monotonic() < deadline:
+            sleep(min(1, deadline - time.monotonic()))
+
+    # Parses a date/time column (LoginTime, ReleaseTime) to a timestamp, empty cells give None
+    @staticmethod
+    def parse_time(value):
+        if value is None or str(value).strip().lower() in ('', 'nan', 'none'):
+            return None
+        from dateutil import parser as date_parser
+        return date_parser.parse(str(value).strip()).timestamp()
+
+    # Reads Accounts.csv into Account records, invalid rows are reported and skipped
+    def load_accounts(self):
+        accounts = {}
+        with open(self.file_path_accounts, newline='', encoding='utf-8-sig') as accounts_file:
+            for line, row in enumerate(csv.DictReader(accounts_file), start=2):
+                try:
+                    row = Account.clean_row(row)
+                    if row['Email'] in accounts:
+                        account = accounts[row['Email']]
+                        account.add_target(Target.from_row(row, priority=len(account.Targets)))
+                    else:
+                        accounts[row['Email']] = Account.from_row(row)
+                except ValueError as e:
+                    LOGGER.error(f'Skipping Accounts.csv line {line}: {e}')
+        return list(accounts.values())
+
+    # Takes the next target of the account, None when all are served
+    def next_target(self, account):
+        with self.status_lock:
+            if not account.Targets:
+                # A target pushed from now on needs a new task, see push_target
+                self.task_status[account["Email"]] = 'Finishing'
+                return None
+            # Kept after the last target as well, its order may still be confirming
+            account.Current = account.Targets.pop(0)
+            return account.Current
+
+    # Reads the product URLs of URL.txt
+    def read_urls(self):
+        try:
+            with open(self.file_path_urls, encoding='utf-8') as urls_file:
+                return [line.strip() for line in urls_file if line.strip() and not line.startswith('#')]
+        except OSError:
+            return []
+
+    # Queues a target for a running account, starting a new task for it if its worker already finished
+    def push_target(self, account, target):
+        email = account["Email"]
+        with self.status_lock:
+            account.add_target(target)
+            restart = self.task_status.get(email) not in ('Pending', 'Running')
+            if restart and self.executor is not None and not self.stopped:
+                self.task_status[email] = 'Pending'
+                self.futures[email] = self.executor.submit(self.run_task, account)
+        # Watched right away when the account is waiting on the drop monitor
+        if target["ReleaseTime"] is None:
+            self.drop_monitor.add(email, target)
+        LOGGER.info(f'Target queued: {target["ProductURL"]}', extra={'account': email})
+
+    # New lines of URL.txt become targets of every account, with the sizes of the account's first row
+    def reload_urls(self):
+        for url in self.read_urls():
+            if url in self.known_urls:
+                continue
+            self.known_urls.add(url)
+            LOGGER.info(f'New URL in URL.txt: {url}')
+            for account in list(self.accounts.values()):
+                self.push_target(account, Target(ProductTitle='', ProductURL=url, ShoesSizes=account["ShoesSizes"],
+                                                 ReleaseTime=None, Priority=len(account.Targets)))
+
+    # Applies edits of Accounts.csv: new accounts are started, new products are queued, edited products are
+    # updated in place and removed ones are withdrawn, running browsers and sessions are left alone
+    def reload_accounts(self):
+        loaded_accounts = self.load_accounts()
+        for loaded in loaded_accounts:
+            email = loaded["Email"]
+            account = self.accounts.get(email)
+            if account is None:
+                LOGGER.info('New account in Accounts.csv', extra={'account': email})
+                self.accounts[email] = loaded
+                login_time = loaded["LoginTime"]
+                self.driver_pool.warm(loaded, at=None if login_time is None else login_time - self.WARMUP_LEAD)
+                with self.status_lock:
+                    self.task_status[email] = 'Finishing'
+                targets, loaded.Targets = loaded.Targets, []
+                for target in targets:
+                    self.push_target(loaded, target)
+                continue
+            with self.status_lock:
+                # The target being bought has left the queue but is not served yet either
+                serving = [account.Current] if account.Current is not None else []
+                known = {target["ProductURL"]: target for target in account.Targets + serving}
+            for target in loaded.Targets:
+                queued = known.get(target["ProductURL"])
+                if queued is None:
+                    continue
+                # Same product: take over the edited title, sizes, release time and priority
+                with self.status_lock:
+                    for field in Target.FIELDS:
+                        setattr(queued, field, target[field])
+                    account.Targets.sort(key=Target.sort_key)
+            served = self.served_urls(email)
+            for target in loaded.Targets:
+                if target["ProductURL"] not in known and target["ProductURL"] not in served:
+                    self.push_target(account, target)
+        # Queued products no longer in the file are withdrawn, unless they came from URL.txt. The one being
+        # bought is finished
+        listed = {(loaded["Email"], target["ProductURL"]) for loaded in loaded_accounts for target in loaded.Targets}
+        for email, account in list(self.accounts.items()):
+            with self.status_lock:
+                withdrawn = [target for target in account.Targets if (email, target["ProductURL"]) not in listed
+                             and target["ProductURL"] not in self.known_urls]
+                for target in withdrawn:
+                    account.Targets.remove(target)
+            for target in withdrawn:
+                # A drop found meanwhile is skipped by get_drop, see switch_target
+                self.drop_monitor.unregister(email, str(target["ProductURL"]))
+                LOGGER.info(f'Target withdrawn: {target["ProductURL"]}', extra={'account': email})
+
+    # Product URLs the account already tried
+    def served_urls(self, email):
+        with self.status_lock:
+            return set(self.order_results.get(email, {}))
+
+    def file_changed(self, path):
+        LOGGER.info(f'File changed: {path}')
+        try:
+            if path == self.file_path_urls:
+                self.reload_urls()
+            else:
+                self.reload_accounts()
+        except Exception as e:
+            LOGGER.error(f'Reloading {path} failed: {e!r}')
+
+    # Waits until the given (NTP-corrected) timestamp is reached or the bot is stopped
+    def wait_until(self, timestamp):
+        # Sleep coarsely, then in small steps and spin for the last couple of milliseconds
+        self.idle(timestamp - self.now() - 0.5)
+        while not self.stopped and timestamp - self.now() > 0.002:
+            sleep(0.001)
+        while not self.stopped and self.now() < timestamp:
+            pass
+        return not self.stopped
+
+    # Renews a session that would expire around the release while the browser is idle anyway: the signed-in
+    # page is reloaded and its cookies saved again, only when it is signed out the credentials are used.
+    # Returns False when the bot was stopped while waiting
+    def renew_session(self, driver, account, target):
+        from selenium.common.exceptions import TimeoutException, WebDriverException
+        email = account["Email"]
+        release_time = target["ReleaseTime"]
+        if self.session_store.is_alive(email, at=release_time + self.SESSION_REFRESH_LEAD):
+            return True
+        LOGGER.info('Session expires before the release, renewing it ahead of time')
+        if not self.wait_until(release_time - self.SESSION_REFRESH_LEAD):
+            return False
+        try:
+            LOGGER.info(f'Requesting: {self.NIKE_HOME_URL}')
+            driver.get(self.NIKE_HOME_URL)
+            try:
+                self.wait_until_visible(driver=driver, css_selector='#AccountMenu', duration=self.TIMEOUTS['session'])
+                self.session_store.save(email, driver.get_cookies(), verified=time.time())
+                LOGGER.info('Session renewed')
+                return True
+            except TimeoutException:
+                LOGGER.info('Session is signed out, signing in again')
+                self.session_store.mark_dead(email)
+                driver.delete_all_cookies()
+            self.login_nike(driver=driver, account=account, force=True)
+        except WebDriverException as e:
+            # The release is still tried with the session there is
+            LOGGER.warning(f'Session renewal failed: {e!r}')
+        return True
 
-    # Buy a drop
+    # Stages the product page before the ReleaseTime and reloads it at the exact moment
+    def stage_drop(self, driver, account, target):
+        product_url = target["ProductURL"]
+        release_time = target["ReleaseTime"]
+        LOGGER.info(f'Waiting to stage release: {datetime.fromtimestamp(release_time)}')
+        if not self.wait_until(release_time - self.STAGE_LEAD):
+            return False
+        LOGGER.info(f'Staging item: {product_url}')
+        driver.get(product_url)
+        if not self.wait_until(release_time):
+            return False
+        LOGGER.info(f'Release fired {(self.now() - release_time) * 1000:.1f} ms after target')
+        driver.refresh()
+        return True
+
+    # Buy a drop: the account's browser is launched and logged in once and then serves its targets one by one
     def buy_drop(self, account):
         email = account["Email"]
-        change_shipping = account["ChangeShipping"]
-        add_new_card = account["AddNewCard"]
-        card_cvv = str(account["CVV"])
-        # Get a webdriver instance
-        driver = self.get_driver(account=account)
-        # Check and login to the website
-        self.login_nike(driver=driver, account=account)
-        # Try delete the items from the cart if there's any
-        self.empty_cart(driver=driver, email=email)
-        # Get drop
-        self.get_drop(driver=driver, account=account)
-        item_purchased = False
-        self.add_to_cart(driver=driver, account=account)
-        # Submit delivery and payment
-        if str(change_shipping).lower() == 'yes':
-            self.change_delivery_option(driver=driver, account=account)
+        # Wait for the LoginTime and take over the pre-warmed webdriver instance
+        login_time = account["LoginTime"]
+        if login_time is not None:
+            LOGGER.info(f'Waiting for LoginTime: {datetime.fromtimestamp(login_time)}')
+            if not self.wait_until(login_time):
+                return False
+        span = self.timings.span
+        with span('driver_launch'):
+            driver = self.driver_pool.acquire(account)
+        orders_placed = 0
+        # Target taken from the queue while the previous order was handed off, see below
+        following = None
+        try:
+            while not self.stopped:
+                target, following = following or self.next_target(account), None
+                if target is None:
+                    break
+                LOGGER.info(f'Next target: {target["ProductURL"]} ({len(account.Targets)} more queued)')
+                # An order placed before a restart is not placed again
+                if self.session_store.last_stage(email, target["ProductURL"], max_age=self.CHECKPOINT_TTL) == 'order_placed':
+                    LOGGER.info('Order was placed before the restart')
+                    self.record_order(email, target, 'Placed earlier')
+                    continue
+                try:
+                    order_placed = self.buy_target(driver=driver, account=account, target=target)
+                except Exception as e:
+                    LOGGER.error(f'Target failed: {account.Current["ProductURL"]}: {e!r}')
+                    self.record_order(email, account.Current, 'Failed')
+                    continue
+                # The target that dropped first, see get_drop
+                target = account.Current
+                if target is None:
+                    # Queued again, the scheduled release is served first
+                    continue
+                if not order_placed:
+                    self.record_order(email, target, 'Not placed')
+                    # Nothing is carted, a new attempt starts over
+                    self.session_store.clear_checkpoint(email, target["ProductURL"])
+                    continue
+                orders_placed += 1
+                LOGGER.info("Order is being placed")
+                # Decided under status_lock: with no target left the task is Finishing, so a target pushed
+                # from now on starts a new task instead of waiting for this one
+                following = self.next_target(account)
+                if following is not None:
+                    # The browser is needed for the next target, confirm right here, but only until a scheduled
+                    # next target needs the browser
+                    duration = self.TIMEOUTS['confirm']
+                    if following["ReleaseTime"] is not None:
+                        duration = min(duration, self.due_time(email, following) - self.now())
+                        if duration < self.TIMEOUTS['confirm']:
+                            LOGGER.info(f'Next release is due, waiting {max(0, duration):.0f} s for the confirmation')
+                    self.confirm_order(driver, account, target, release=False, duration=duration)
+                else:
+                    # Confirm in the background, the worker is free for the next task right away
+                    if self.confirm_executor is not None:
+                        self.confirm_executor.submit(self.confirm_order, driver, account, target)
+                    else:
+                        self.confirm_order(driver, account, target)
+                    driver = None
+                    break
+            return orders_placed > 0
+        finally:
+            # Release the driver unless it was handed over to the confirmation
+            if driver is not None:
+                self.driver_pool.release(driver)
+
+    # Buys one target with the account's browser, returns whether the order was placed. Each stage is saved once
+    # it completed: a stage failing with a WebDriver error is retried, and a restarted task skips the stages up
+    # to the item in the cart and continues on the checkout page
+    def buy_target(self, driver, account, target):
+        email = account["Email"]
+        done = self.session_store.last_stage(email, target["ProductURL"], max_age=self.CHECKPOINT_TTL)
+        done = self.STAGES.index(done) if done is not None else -1
+        # Shared by the retries of all stages, see run_stage
+        budget = {}
+        # Product page the drop was found on, reloaded when adding to the cart is retried
+        found = {}
+
+        # Runs a step in its own span and records the page it ended on, as named in the run report
+        def step(name, function, measure=True, **kwargs):
+            with self.timings.span(name):
+                result = function(driver=driver, **kwargs)
+            if measure:
+                self.measure_page(driver, name)
+            return result
+
+        def checkout():
+            LOGGER.info(f'Requesting: {self.NIKE_CHECKOUT_URL}')
+            driver.get(self.NIKE_CHECKOUT_URL)
+
+        # Set by place_order once the submit click is sent, the order is never submitted twice
+        sent = {}
+
+        def submit_order():
+            if sent:
+                # The failure came after the submit click: only look whether the order went through
+                LOGGER.info('Order was submitted before the failure, checking for the confirmation')
+                self.wait_until_visible(driver, css_selector=self.ORDER_CONFIRMATION, duration=self.TIMEOUTS['checkout'], clickable=False)
+                return True
+            return step('place_order', self.place_order, measure=False, cvv=str(account["CVV"]), sent=sent)
+
+        def cart_item():
+            nonlocal target
+            if 'url' in found:
+                # The failed attempt may have added the item already, it must not end up twice in the cart
+                step('empty_cart', self.empty_cart, email=email)
+                driver.get(found['url'])
+            else:
+                # Get drop: at the scheduled ReleaseTime, or by watching the launch feed
+                with self.timings.span('get_drop'):
+                    if target["ReleaseTime"] is not None:
+                        found['url'] = self.stage_drop(driver=driver, account=account, target=target) and target["ProductURL"]
+                    else:
+                        found['url'] = self.get_drop(driver=driver, account=account, target=target)
+                        # Another of the account's targets may have dropped first, the rest of the stages buy that one.
+                        # None when the target was queued again for a scheduled release
+                        target = account.Current
+                if not found['url']:
+                    return False
+                self.measure_page(driver, 'get_drop')
+            return step('add_to_cart', self.add_to_cart, account=account, target=target)
+
+        stages = [
+            ('logged_in', lambda: step('login_nike', self.login_nike, account=account), None),
+            ('cart_cleared', lambda: step('empty_cart', self.empty_cart, email=email), None),
+            ('item_carted', cart_item, None),
+        ]
         # Submit delivery and payment
-        if str(add_new_card).lower() == 'yes':
-            # Submit card information
-            self.add_new_card(driver=driver, account=account)
-        # Place order
-        order_placed = self.place_order(driver=driver, cvv=card_cvv)
-        # Break the while loop if item is purchased
-        if order_placed:
-            LOGGER.info("Order is being placed")
-        LOGGER.info("Browser will be closed automatically within 5 minutes:")
-        sleep(300)
-        # Quit the driver
-        self.finish(driver=driver)
+        if account["ChangeShipping"]:
+            stages.append(('shipping_set', lambda: step('change_delivery_option', self.change_delivery_option, account=account), checkout))
+        if account["AddNewCard"]:
+            stages.append(('card_added', lambda: step('add_new_card', self.add_new_card, account=account), checkout))
+        # The checkout is only reloaded for a retry as long as nothing was submitted
+        stages.append(('order_placed', submit_order, lambda: None if sent else checkout()))
+        carted = resume = done >= self.STAGES.index('item_carted')
+        if resume:
+            LOGGER.info(f'Resuming after stage: {self.STAGES[done]}')
+        for stage, action, restore in stages:
+            # A new browser always signs in. The stages up to the saved one are only skipped once the item is in
+            # the cart: before that the cart is always cleared, a crash may have left the item added already
+            if carted and stage != 'logged_in' and self.STAGES.index(stage) <= done:
+                continue
+            if self.stopped:
+                return False
+            # Not part of the retried stage: a failed renewal must not cost the release
+            if stage == 'item_carted' and target["ReleaseTime"] is not None:
+                if not self.renew_session(driver=driver, account=account, target=target):
+                    return False
+            if not self.run_stage(account, target, stage, action, budget, restore,
+                                  resume=resume and stage != 'logged_in'):
+                return False
+            # The checkout is loaded once, before the first stage after signing in
+            if stage != 'logged_in':
+                resume = False
+        return True
+
+    # Runs a stage and saves it as completed. A WebDriverException is retried after restore, which brings the
+    # browser back to where the stage starts, until STAGE_BUDGET seconds after the first failure of the target.
+    # With resume, restore also runs before the first attempt. Returns False when the stage returned False.
+    # The spans and page measurements are the ones of the steps the action runs, see buy_target
+    def run_stage(self, account, target, stage, action, budget, restore=None, resume=False):
+        from selenium.common.exceptions import WebDriverException
+        attempt = 1
+        while True:
+            try:
+                if restore is not None and (resume or attempt > 1):
+                    restore()
+                result = action()
+                break
+            except WebDriverException as e:
+                budget.setdefault('deadline', time.monotonic() + self.STAGE_BUDGET)
+                if self.stopped or time.monotonic() + self.STAGE_RETRY_DELAY > budget['deadline']:
+                    raise
+                LOGGER.warning(f'Stage {stage} failed (attempt {attempt}), retrying: {e!r}')
+                attempt += 1
+                sleep(self.STAGE_RETRY_DELAY)
+        if result is False:
+            return False
+        self.session_store.checkpoint(account["Email"], target["ProductURL"], stage)
+        return True
+
+    def record_order(self, email, target, result):
+        with self.status_lock:
+            self.order_results.setdefault(email, {})[target["ProductURL"]] = result
+        self.publish('order', email, target["ProductURL"], result)
+        LOGGER.info(f'Order result: {result}: {target["ProductURL"]}', extra={'account': email})
+
+    # Waits a bounded time for the order confirmation, by default TIMEOUTS['confirm'] seconds, records the result
+    # and releases the driver
+    def confirm_order(self, driver, account, target, release=True, duration=None):
+        email = account["Email"]
+        self.set_context(email)
+        if duration is None:
+            duration = self.TIMEOUTS['confirm']
+        try:
+            with self.timings.span('confirm_order'):
+                self.wait_until_visible(driver, css_selector=self.ORDER_CONFIRMATION, duration=duration, clickable=False)
+            self.record_order(email, target, 'Confirmed')
+        except Exception as e:
+            LOGGER.warning(f'Order not confirmed: {e!r}')
+            self.record_order(email, target, 'Unconfirmed')
+        finally:
+            if release:
+                self.driver_pool.release(driver)
+
+    # Account that the logs and timings of the current thread belong to
+    def set_context(self, account):
+        LOG_CONTEXT.account = account
+        self.timings.set_account(account)
+
+    # Sets the status of an account's task
+    def set_status(self, email, status):
+        with self.status_lock:
+            self.task_status[email] = status
+        self.publish('status', email, status)
+        LOGGER.info(f'Task status: {status}', extra={'account': email})
+
+    # Sends an update to the coordinator when running as a shard
+    def publish(self, kind, *payload):
+        if self.events is not None:
+            self.events.put((kind, *payload))
+
+    # Runs a single account in its own worker, a failure never reaches the other workers
+    def run_task(self, account):
+        email = account["Email"]
+        if self.stopped:
+            self.set_status(email, 'Cancelled')
+            return False
+        self.set_status(email, 'Running')
+        self.set_context(email)
+        try:
+            with self.timings.span('buy_drop'):
+                self.buy_drop(account)
+        except Exception as e:
+            LOGGER.error(f'Task failed: {e!r}')
+            self.set_status(email, 'Failed')
+            return False
+        with self.status_lock:
+            # Unless a target pushed meanwhile started the next task
+            if self.task_status.get(email) in ('Running', 'Finishing'):
+                self.task_status[email] = 'Cancelled' if self.stopped else 'Done'
+            status = self.task_status[email]
+        self.publish('status', email, status)
+        LOGGER.info(f'Task status: {status}', extra={'account': email})
+        return True
+
+    # Runs all accounts with bounded concurrency until they finish or the bot is stopped
+    def run_tasks(self, accounts):
+        # Accounts added at run time need free workers too
+        num_workers = self.MAX_WORKERS if self.WATCH_FILES else max(1, min(len(accounts), self.MAX_WORKERS))
+        self.accounts = {account["Email"]: account for account in accounts}
+        # Sync the clock once before anything is scheduled
+        self.get_clock_offset()
+        LOGGER.info(f'Starting {len(accounts)} tasks with {num_workers} workers')
+        executor = self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='Task')
+        self.confirm_executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='Confirm')
+        # Warm the browsers in the order they are needed, as many as the workers will take up
+        for account in sorted(accounts, key=lambda a: a["LoginTime"] or 0):
+            login_time = account["LoginTime"]
+            self.driver_pool.warm(account, at=None if login_time is None else login_time - self.WARMUP_LEAD)
+        for account in accounts:
+            self.set_status(account["Email"], 'Pending')
+            self.futures[account["Email"]] = executor.submit(self.run_task, account)
+        watcher = None
+        if self.WATCH_FILES:
+            self.known_urls = set(self.read_urls())
+            watcher = FileWatcher([self.file_path_urls, self.file_path_accounts], self.file_changed).start()
+            LOGGER.info('Watching URL.txt and Accounts.csv for new targets, press Ctrl+C to stop')
+        try:
+            # Without the watcher the run ends when all tasks are done
+            while not self.stopped:
+                pending = [future for future in list(self.futures.values()) if not future.done()]
+                if not pending and watcher is None:
+                    break
+                if pending:
+                    concurrent.futures.wait(pending, timeout=1)
+                else:
+                    sleep(1)
+                self.governor.sample()
+        except KeyboardInterrupt:
+            LOGGER.warning('Interrupted, stopping all tasks')
+            self.stop()
+        finally:
+            if watcher is not None:
+                watcher.stop()
+            self.executor = None
+            executor.shutdown(wait=True, cancel_futures=self.stopped)
+            # Confirmations are bounded by TIMEOUTS['confirm'] and always release their driver
+            self.confirm_executor.shutdown(wait=True)
+            self.confirm_executor = None
+            self.driver_pool.shutdown()
+        with self.status_lock:
+            LOGGER.info(f'Tasks finished: {self.task_status}')
+        self.export_report()
+        return dict(self.task_status)
+
+    # Splits the accounts across PROCESSES worker processes and collects their status, order results,
+    # timings and logs, so that no single interpreter drives all browsers
+    def run_sharded(self, accounts):
+        import multiprocessing
+        # Spawned, not forked: the logging, pool and browser threads of this process do not survive a fork
+        context = multiprocessing.get_context('spawn')
+        processes = max(1, min(self.PROCESSES, len(accounts)))
+        # Round-robin by LoginTime so that every shard gets early and late accounts
+        accounts = sorted(accounts, key=lambda a: a["LoginTime"] or 0)
+        shards = [accounts[shard::processes] for shard in range(processes)]
+        # Sync the clock once for all shards
+        self.get_clock_offset()
+        settings = {name: value for name, value in vars(self).items() if name.isupper() or name.startswith('file_path_')}
+        settings.update(clock_offset=self.clock_offset, WATCH_FILES=False)
+        # The shards share the memory budget
+        budget = self.governor.budget()
+        settings['MEMORY_BUDGET'] = budget / processes if budget else None
+        store = (self.session_store.path, self.session_store.legacy_dir)
+        events, log_queue, self.stop_event = context.Queue(), context.Queue(), context.Event()
+        # Records of the shards are written by this process like its own
+        log_listener = logging.handlers.QueueListener(log_queue, *logging.getLogger("SNKRsBot.writer").handlers,
+                                                      respect_handler_level=True)
+        log_listener.start()
+        LOGGER.info(f'Starting {len(accounts)} tasks in {processes} processes with up to {self.MAX_WORKERS} workers each')
+        for account in accounts:
+            self.set_status(account["Email"], 'Pending')
+        workers = [context.Process(target=run_shard, name=f'Shard-{shard}',
+                                   args=(shard, shard_accounts, settings, store, events, log_queue, self.stop_event))
+                   for shard, shard_accounts in enumerate(shards)]
+        for worker in workers:
+            worker.start()
+        running = set(range(processes))
+        while running:
+            try:
+                kind, *payload = events.get(timeout=1)
+            except queue.Empty:
+                for shard in list(running):
+                    if not workers[shard].is_alive():
+                        LOGGER.error(f'Shard {shard} exited with code {workers[shard].exitcode}')
+                        running.discard(shard)
+                continue
+            except KeyboardInterrupt:
+                LOGGER.warning('Interrupted, stopping all shards')
+                self.stop()
+                continue
+            if kind == 'status':
+                email, status = payload
+                with self.status_lock:
+                    self.task_status[email] = status
+            elif kind == 'order':
+                email, product_url, result = payload
+                with self.status_lock:
+                    self.order_results.setdefault(email, {})[product_url] = result
+            elif kind == 'timings':
+                self.timings.merge(*payload)
+            elif kind == 'resources':
+                shard, summary = payload
+                self.shard_resources[shard] = summary
+            elif kind == 'done':
+                running.discard(payload[0])
+        for worker in workers:
+            worker.join()
+        # Tasks of a shard that failed or died never reported an end
+        for account in accounts:
+            if self.task_status.get(account["Email"]) in ('Pending', 'Running', 'Finishing'):
+                self.set_status(account["Email"], 'Failed')
+        log_listener.stop()
+        self.stop_event = None
+        with self.status_lock:
+            LOGGER.info(f'Tasks finished: {self.task_status}')
+        self.export_report()
+        return dict(self.task_status)
+
+    # Writes the per-stage latency report of the run
+    def export_report(self):
+        # Shards send their timings to the coordinator, which writes the report
+        if self.events is not None:
+            return
+        try:
+            extra = {'tasks': dict(self.task_status), 'orders': dict(self.order_results),
+                     'resources': self.shard_resources or self.governor.summary()}
+            json_path, csv_path = self.timings.export(self.PROJECT_ROOT / 'SNKRsRes/Reports', extra=extra)
+            LOGGER.info(f'Run report saved: {json_path}, {csv_path}')
+        except OSError as e:
+            LOGGER.error(f'Run report could not be saved: {e!r}')
+
+    # Cancels a single task if it has not started yet
+    def cancel(self, email):
+        future = self.futures.get(email)
+        if future is not None and future.cancel():
+            self.set_status(email, 'Cancelled')
+            return True
+        return False
+
+    # Stops the bot: pending tasks are cancelled and running tasks exit at their next check
+    def stop(self):
+        self.stopped = True
+        if self.stop_event is not None:
+            self.stop_event.set()
+        for email in list(self.futures):
+            self.cancel(email)
 
     def main(self):
         freeze_support()
@@ -466,6 +2112,7 @@ class SNKRsBot:
         trial_date = datetime.strptime('2021-08-05 23:59:59', '%Y-%m-%d %H:%M:%S')
         # Print ASCII Art
         print('************************************************************************\n')
+        import pyfiglet
         pyfiglet.print_figlet('____________                      SNKRsBot ____________\n', colors='RED')
         print('Author: Ali Toori, Bot Developer\n'
               'Website: https://botflocks.com/\nLinkedIn: https://www.linkedin.com/in/alitoori/\n************************************************************************')
@@ -474,21 +2121,51 @@ class SNKRsBot:
         if True:
             LOGGER.info(f'SNKRsBot launched')
             if os.path.isfile(self.file_path_accounts):
-                account_df = pd.read_csv(self.file_path_accounts, index_col=None)
-                accounts = []
-                for account in account_df.iloc:
-                    accounts.append(account)
-                    self.buy_drop(account)
-                num_workers = len(accounts)
-
-                # Get accounts from Accounts.csv
-                # We can use a with statement to ensure threads are cleaned up promptly
-                # with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-                #     executor.map(self.buy_drop, accounts)
+                # Get accounts from Accounts.csv and run them concurrently, picking up new targets at run time
+                self.WATCH_FILES = True
+                accounts = self.load_accounts()
+                LOGGER.info(f'Startup took {(time.perf_counter() - STARTUP_TIME) * 1000:.1f} ms: {len(accounts)} accounts')
+                if self.PROCESSES > 1:
+                    self.run_sharded(accounts)
+                else:
+                    self.run_tasks(accounts)
         # else:
         #     LOGGER.warning("Your trial has been expired, To get full version, please contact fiverr.com/AliToori !")
 
 
+# Entry point of a process started by SNKRsBot.run_sharded: runs its share of the accounts with its own
+# browsers, sends status, results and timings over events and its log records over log_queue
+def run_shard(shard, accounts, settings, store, events, log_queue, stop_event):
+    # Ctrl+C is handled by the coordinator, which sets stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(AccountFilter())
+    root.addHandler(handler)
+    try:
+        bot = SNKRsBot()
+        for name, value in settings.items():
+            setattr(bot, name, value)
+        bot.session_store = SessionStore(store[0], legacy_dir=store[1], cookie_names=bot.SESSION_COOKIES)
+        bot.events = events
+
+        def watch_stop():
+            stop_event.wait()
+            bot.stop()
+
+        threading.Thread(target=watch_stop, name='StopWatcher', daemon=True).start()
+        LOGGER.info(f'Shard {shard} running {len(accounts)} accounts')
+        bot.run_tasks(accounts)
+        events.put(('timings', bot.timings.spans, bot.timings.pages))
+        events.put(('resources', shard, bot.governor.summary()))
+    except Exception as e:
+        LOGGER.error(f'Shard {shard} failed: {e!r}')
+    finally:
+        events.put(('done', shard))
+
+
 if __name__ == "__main__":
     nike_bot = SNKRsBot()
     nike_bot.main()